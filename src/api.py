@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from requests.adapters import HTTPAdapter
+from google.oauth2.credentials import Credentials
+
+from src.cache import ResponseCache
+from src.hedging import Hedger
+from src.main import sync, sweep, get_google_credentials
+from src.query import SalesQuery
+from src.sellers import Seller, default_seller
+from src.store import month_lock
+from src.tokens import TokenManager, MeliSession
+
+class SalesSync:
+    def __init__(self, seller: Seller | None = None, adapter: HTTPAdapter | None = None, hedger: Hedger | None = None) -> None:
+        self.seller = seller or default_seller()
+        self.adapter = adapter
+        self.hedger = hedger
+        self.query = SalesQuery(self.seller)
+
+        self._tokens = None
+        self._session = None
+        self._creds = None
+
+    # Sessions are opened on first use, so tools that only query never touch the APIs
+    @property
+    def session(self) -> MeliSession:
+        if self._session is None:
+            self._tokens = TokenManager(self.seller.app_id, self.seller.secret_key, self.seller.dotenv_path)
+            self._tokens.start()
+
+            self._session = MeliSession(self._tokens, ResponseCache(f"{self.seller.db_dir}/http_cache", self.seller.cache_freshness), self.hedger)
+            if self.adapter is not None:
+                self._session.mount("https://", self.adapter)
+        return self._session
+
+    @property
+    def credentials(self) -> Credentials:
+        if self._creds is None:
+            self._creds = get_google_credentials()
+        return self._creds
+
+    def sync(self, start: datetime, end: datetime) -> None:
+        with month_lock(self.seller.db_dir, start.strftime("%B_%y").lower()):
+            sync(self.session, self.seller, start, end, self.credentials)
+
+    def sweep(self) -> dict:
+        return sweep(self.session, self.seller, self.credentials)
+
+    def get_sale(self, order_id: int) -> dict | None:
+        return self.query.get_sale(order_id)
+
+    def find_sales(self, identification: str | None = None, start: datetime | None = None, end: datetime | None = None) -> list:
+        return self.query.find_sales(identification, start, end)
+
+    def get_pending_invoices(self, month: str) -> list:
+        return self.query.get_pending_invoices(month)
+
+    def close(self) -> None:
+        if self._tokens is not None:
+            self._tokens.stop()
+        if self._session is not None:
+            self._session.cache.prune()
+            self._session.close(keep_adapters=self.adapter is not None)
+
+    def __enter__(self) -> "SalesSync":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,78 @@
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from src.store import list_months, get_month_path, load_month
+
+COLUMNS_DTYPES = {
+    "id" : "int64",
+    "cancelled" : "bool",
+    "product" : "string",
+    "total" : "float64",
+    "quantity" : "int64",
+    "unit_price" : "float64",
+    "shipping_cost" : "float64",
+    "name" : "string",
+    "identification" : "string",
+    "tax_status" : "category",
+    "address" : "string",
+    "jurisdiction" : "category"
+}
+
+def create_archive_dataframe(record: list) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(record)
+
+    if "cancellation_date" not in df:
+        df["cancellation_date"] = None
+
+    df = df.astype(COLUMNS_DTYPES)
+    df["sale_date"] = pd.to_datetime(df["sale_date"], utc=True)
+    df["cancellation_date"] = pd.to_datetime(df["cancellation_date"], utc=True)
+
+    return df[["id", "sale_date", "cancelled", "cancellation_date", *[column for column in COLUMNS_DTYPES if column not in ["id", "cancelled"]]]]
+
+def export_archive(db_dir: str = "sales_db", archive_dir: str = "sales_archive") -> list:
+    exported = []
+    for month in list_months(db_dir):
+        date = datetime.strptime(month, "%B_%y")
+        path = get_month_path(db_dir, month)
+
+        partition = f"{archive_dir}/year={date.year}/month={date.month}"
+        archive_path = f"{partition}/sales.parquet"
+
+        # Months that haven't changed since their last export are left alone
+        if os.path.exists(archive_path) and os.path.getmtime(archive_path) >= os.path.getmtime(path):
+            continue
+
+        d = load_month(db_dir, month)
+
+        if len(d["sales"]) == 0:
+            continue
+
+        os.makedirs(partition, exist_ok=True)
+        create_archive_dataframe(d["sales"]).to_parquet(archive_path, engine="pyarrow", compression="zstd", index=False)
+        exported.append(month)
+
+    return exported
+
+def query_archive(columns: list | None = None, start: datetime | None = None, end: datetime | None = None, filters: list | None = None, archive_dir: str = "sales_archive") -> pd.DataFrame:
+    filters = list(filters or [])
+
+    if start:
+        filters.append(("year", ">=", start.year))
+        filters.append(("sale_date", ">=", pd.Timestamp(start).tz_convert("UTC") if start.tzinfo else pd.Timestamp(start, tz="UTC")))
+    if end:
+        filters.append(("year", "<=", end.year))
+        filters.append(("sale_date", "<=", pd.Timestamp(end).tz_convert("UTC") if end.tzinfo else pd.Timestamp(end, tz="UTC")))
+    if start and end and start.year == end.year:
+        filters.append(("month", ">=", start.month))
+        filters.append(("month", "<=", end.month))
+
+    return pd.read_parquet(archive_dir, engine="pyarrow", columns=columns, filters=filters or None)
+
+if __name__ == "__main__":
+    db_dir = sys.argv[1] if len(sys.argv) > 1 else "sales_db"
+    exported = export_archive(db_dir)
+    print(f"Exported {len(exported)} month(s): {', '.join(exported)}")
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from glob import glob
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
+
+# (days since the month ended, seconds a cached response is served without asking the server)
+FRESHNESS = [
+    (0, 0),
+    (7, 60 * 60),
+    (60, 24 * 60 * 60),
+    (365, 30 * 24 * 60 * 60)
+]
+
+def get_max_age(end: datetime, freshness: list | None = None) -> int:
+    now = datetime.now(tz=BS_AS_TZ)
+    age = (now - end).days if end.tzinfo else (now.replace(tzinfo=None) - end).days
+
+    max_age = 0
+    for days, seconds in sorted(freshness or FRESHNESS):
+        if age >= days:
+            max_age = seconds
+    return max_age
+
+class ResponseCache:
+    def __init__(self, cache_dir: str = "sales_db/http_cache", freshness: list | None = None) -> None:
+        self.cache_dir = cache_dir
+        self.freshness = freshness or FRESHNESS
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, url: str, params: dict | None, headers: dict | None) -> str:
+        params = sorted((str(key), str(value)) for key, value in (params or {}).items())
+        headers = sorted((key, value) for key, value in (headers or {}).items() if key.lower() != "authorization")
+        return hashlib.sha256(json.dumps([url, params, headers]).encode()).hexdigest()
+
+    def load(self, key: str) -> dict | None:
+        try:
+            with open(f"{self.cache_dir}/{key}.json", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get_max_age(self, end: datetime) -> int:
+        return get_max_age(end, self.freshness)
+
+    def save(self, key: str, entry: dict) -> None:
+        # Other runs and threads may be saving the same key
+        tmp_path = f"{self.cache_dir}/{key}.json.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, f"{self.cache_dir}/{key}.json")
+
+    def get_conditional_headers(self, entry: dict) -> dict:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def is_fresh(self, entry: dict, max_age: int) -> bool:
+        return time.time() - entry["fetched_at"] < max_age
+
+    def store(self, key: str, r: requests.Response, entry: dict | None = None) -> requests.Response:
+        if r.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            entry["fetched_at"] = time.time()
+            self.save(key, entry)
+            return self.to_response(entry)
+
+        self.misses += 1
+        if r.status_code == 200:
+            self.save(key, {"url" : r.url,
+                            "etag" : r.headers.get("ETag"),
+                            "last_modified" : r.headers.get("Last-Modified"),
+                            "content_type" : r.headers.get("Content-Type"),
+                            "fetched_at" : time.time(),
+                            "body" : r.text})
+        return r
+
+    def prune(self) -> int:
+        # Entries in use are revalidated well within twice the longest freshness, the rest are dropped
+        cutoff = time.time() - 2 * max(seconds for _, seconds in self.freshness)
+
+        removed = 0
+        for path in glob(f"{self.cache_dir}/*.json") + glob(f"{self.cache_dir}/*.tmp"):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def to_response(self, entry: dict) -> requests.Response:
+        r = requests.Response()
+        r.status_code = 200
+        r.url = entry["url"]
+        r.encoding = "utf-8"
+        r.headers = CaseInsensitiveDict({"Content-Type" : entry["content_type"] or "application/json"})
+        r._content = entry["body"].encode("utf-8")
+        return r
@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class Hedger:
+    def __init__(self, percentile: float = 95, max_ratio: float = 0.05, min_samples: int = 20, window: int = 200, max_workers: int = 32) -> None:
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self.saved = 0.0
+
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def get_threshold(self) -> float | None:
+        with self._lock:
+            if len(self._latencies) < max(self.min_samples, 1):
+                return None
+            latencies = sorted(self._latencies)
+
+        return latencies[min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)]
+
+    def call(self, func):
+        threshold = self.get_threshold()
+        with self._lock:
+            self.requests += 1
+
+        start = time.monotonic()
+        primary = self._executor.submit(func)
+        primary.add_done_callback(lambda future: self._record(start, future))
+
+        if threshold is None:
+            return primary.result()
+
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._reserve_hedge():
+            return primary.result()
+
+        hedge = self._executor.submit(func)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+
+        winner = primary if primary in done else hedge
+        # A failed answer only counts if the other one fails too
+        if winner.exception() is not None:
+            winner = hedge if winner is primary else primary
+
+        if winner is hedge:
+            answered = time.monotonic()
+            with self._lock:
+                self.won += 1
+            primary.add_done_callback(lambda future: self._add_saved(time.monotonic() - answered))
+
+        return winner.result()
+
+    def summary(self) -> str:
+        with self._lock:
+            return f"Hedging: {self.fired} duplicate requests out of {self.requests}, {self.won} answered first, {self.saved:.1f} s saved"
+
+    def close(self) -> None:
+        # Requests still running end at their session's timeout
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _reserve_hedge(self) -> bool:
+        # Duplicates never exceed max_ratio of all the requests sent through the hedger
+        with self._lock:
+            if self.fired + 1 > self.max_ratio * self.requests:
+                return False
+            self.fired += 1
+            return True
+
+    def _record(self, start: float, future) -> None:
+        if future.exception() is None:
+            with self._lock:
+                self._latencies.append(time.monotonic() - start)
+
+    def _add_saved(self, seconds: float) -> None:
+        with self._lock:
+            self.saved += seconds
+
+def create_hedger() -> Hedger | None:
+    percentile = os.environ.get("HEDGE_PERCENTILE")
+    if not percentile:
+        return None
+
+    return Hedger(percentile=float(percentile), max_ratio=float(os.environ.get("HEDGE_MAX_RATIO") or 0.05))
@@ -1,43 +1,58 @@
-import os
 import sys
 import re
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from calendar import monthrange
+from dataclasses import dataclass, replace
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from dotenv import load_dotenv
+import pandas as pd
+from requests.adapters import HTTPAdapter
 
-from google.auth.exceptions import RefreshError
-from googleapiclient.errors import HttpError
+from google.oauth2.credentials import Credentials
 
 from src.sales import update_json, create_sales_dataframe
 from src.sheets import (
-    authorize,
+    get_credentials,
+    build_services,
+    get_thread_services,
+    get_invoice_links,
     add_sheet,
     modify_sales_dataframe,
-    get_done_invoices,
-    get_invoice_numbers,
-    get_invoice_links,
+    read_sheet_state,
     create_cancellations_dataframe,
     write_to_sheet,
-    format_sheet
+    format_sheet,
+    create_sales_matrix,
+    create_cancellations_matrix,
+    write_new_rows,
+    format_new_rows,
+    get_modified_time,
+    load_mirror,
+    save_mirror,
+    get_record_digest
     )
-from src.utils import refresh_token, month_to_spanish, get_invoice_num_formula
-
-load_dotenv()
-APP_ID = os.getenv("APP_ID")
-SECRET_KEY = os.getenv("SECRET_KEY")
-USER_ID = os.getenv("USER_ID")
-ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
-REFRESH_TOKEN = os.getenv("REFRESH_TOKEN")
-EXPIRATION_DATE = datetime.fromisoformat(os.getenv("EXPIRATION_DATE"))
-SPREADSHEET_ID = os.getenv("SPREADSHEET_ID")
-A_INVOICES_FOLDER_ID = os.getenv("A_INVOICES_FOLDER_ID")
-B_INVOICES_FOLDER_ID = os.getenv("B_INVOICES_FOLDER_ID")
+from src.sellers import Seller, default_seller
+from src.shards import get_spreadsheet_id, get_previous_tab, get_sheet_id, get_sheet_name, get_tab_months, get_tabs, load_archived_months
+from src.sweep import collect_cancellations, mark_cancelled, load_sweep_state, save_last_swept, remove_stale_month
+from src.cache import ResponseCache
+from src.hedging import Hedger, create_hedger
+from src.store import month_lock, load_month
+from src.tokens import TokenManager, MeliSession
+from src.totals import load_totals, write_summary, update_totals, apply_totals_delta
+from src.utils import month_to_spanish, get_invoice_num_formula
 
 BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
 
+SUMMARY_SHEET_ID = 100
+
+@dataclass
+class SheetSetup:
+    creds: Credentials
+    tab_exists: bool
+    mirror: dict | None = None
+    invoice_links: tuple[list, list] | None = None
+
 def get_month() -> tuple[datetime, datetime]:
     month = sys.argv[1:]
     
@@ -72,73 +87,229 @@ def get_month() -> tuple[datetime, datetime]:
     
     return start, end
 
-def main(start: datetime, end: datetime) -> None:
-    s = requests.Session()
-    s.headers = {"Authorization" : f"Bearer {ACCESS_TOKEN}"}
+def append_sales(sheets_service, seller: Seller, record: list, appended_from: int, sheet_name: str, sheet_id: int, previous_tab: tuple[str, str] | None = None) -> pd.DataFrame | None:
+    if appended_from == len(record):
+        return None
+    
+    if seller.static_row_styles:
+        # Styling the new rows needs every customer above them
+        sales_df, _ = modify_sales_dataframe(create_sales_dataframe(record), tab_prefix=seller.tab_prefix, previous_tab=previous_tab)
+        new_sales_df = sales_df.iloc[appended_from:]
+        customers = sales_df["DATOS CLIENTE"].tolist()
+    else:
+        new_sales_df, _ = modify_sales_dataframe(create_sales_dataframe(record[appended_from:]), row_offset=appended_from, tab_prefix=seller.tab_prefix, previous_tab=previous_tab)
+        customers = None
+    
+    first_row = appended_from + 3
+    last_row = len(record) + 2
+    
+    write_new_rows(sheets_service, seller.spreadsheet_id, new_sales_df.values.tolist(), first_row, last_row, sheet_name)
+    format_new_rows(sheets_service, seller.spreadsheet_id, first_row - 1, last_row, sheet_id, customers)
+    
+    return new_sales_df
 
-    if datetime.now() > EXPIRATION_DATE:
-        s.headers.update({"Authorization" : f"Bearer {refresh_token(APP_ID, SECRET_KEY, REFRESH_TOKEN)}"})
+def match_invoice_links(invoice_numbers: list, done_invoices: list, a_invoice_links: list, b_invoice_links: list, tab_prefix: str, previous_tab: tuple[str, str] | None = None) -> list:
+    invoice_links = []
+    a_invoice_index = 0
+    b_invoice_index = 0
+    for idx, (invoice, done) in enumerate(zip(invoice_numbers, done_invoices)):
+        if done:
+            if invoice[-1] == "A":
+                while invoice[:-1] != a_invoice_links[a_invoice_index]["num"]:
+                    a_invoice_index += 1
+                invoice_links.append(get_invoice_num_formula(url=a_invoice_links[a_invoice_index]["link"], num=invoice))
+            else:
+                while invoice[:-1] != b_invoice_links[b_invoice_index]["num"]:
+                    b_invoice_index += 1
+                invoice_links.append(get_invoice_num_formula(url=b_invoice_links[b_invoice_index]["link"], num=invoice))
+        else:
+            invoice_links.append(get_invoice_num_formula(row=idx+3, hyperlink=False, tab_prefix=tab_prefix, previous_tab=previous_tab))
+    
+    return invoice_links
+
+def finish_sync(sheets_service, drive_service, seller: Seller, sheet_name: str, record: list, done_invoices: list, invoice_links: list) -> None:
+    write_summary(sheets_service, seller.spreadsheet_id, load_totals(seller.db_dir), f"{seller.tab_prefix} - RESUMEN", SUMMARY_SHEET_ID)
+    
+    # Taken after our own writes, so the next run only reads the sheet back if someone else edited it
+    save_mirror(seller.db_dir, seller.spreadsheet_id, sheet_name, get_modified_time(drive_service, seller.spreadsheet_id), record, done_invoices, invoice_links, seller.static_row_styles)
+
+def main(start: datetime, end: datetime, seller: Seller, adapter: HTTPAdapter | None = None, hedger: Hedger | None = None) -> None:
+    tokens = TokenManager(seller.app_id, seller.secret_key, seller.dotenv_path)
+    tokens.start()
+    
+    s = MeliSession(tokens, ResponseCache(f"{seller.db_dir}/http_cache", seller.cache_freshness), hedger)
+    if adapter is not None:
+        s.mount("https://", adapter)
 
+    try:
+        # Another run on the same month would overwrite whatever this one stores
+        with month_lock(seller.db_dir, start.strftime("%B_%y").lower()):
+            sync(s, seller, start, end)
+        
+        for month, count in sweep(s, seller).items():
+            print(f"{seller.name}: {count} sale(s) from {month} cancelled since the last sweep")
+    finally:
+        tokens.stop()
+        print(f"HTTP cache: {s.cache.hits} served from disk, {s.cache.revalidated} revalidated, {s.cache.misses} downloaded, {s.cache.prune()} unused entries removed")
+        print(f"HTTP transfer: {s.wire_bytes / 1024:.0f} KiB over the wire for {s.content_bytes / 1024:.0f} KiB of responses, {(s.content_bytes - s.wire_bytes) / 1024:.0f} KiB saved by gzip")
+        print(f"Orders: {s.received_order_bytes / 1024:.0f} KiB received, {(s.received_order_bytes - s.kept_order_bytes) / 1024:.0f} KiB of unused fields trimmed before storing")
+        # Also closes the per-thread sessions opened for the parallel downloads
+        s.close(keep_adapters=adapter is not None)
+
+def sync(s: MeliSession, seller: Seller, start: datetime, end: datetime, creds: Credentials | None = None) -> None:
+    # The Google chain only needs the orders for the final write, so it runs while they download
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        setup = executor.submit(prepare_sheet, seller, start, creds)
+        record = update_json(s, seller.user_id, start, end, seller.db_dir)
+    
+    setup = setup.result()
+    write_month(setup.creds, seller, start, record, setup)
+
+def prepare_sheet(seller: Seller, start: datetime, creds: Credentials | None = None) -> SheetSetup:
+    creds = creds or get_google_credentials()
+    spreadsheet_id = get_spreadsheet_id(seller, start.year)
+    sheet_name = get_sheet_name(seller, start.month)
+    mirror = load_mirror(seller.db_dir, spreadsheet_id, sheet_name)
+    
+    def sheets_read(func, *args):
+        return func(get_thread_services(creds)[0], *args)
+    
+    def drive_read(func, *args):
+        return func(get_thread_services(creds)[1], *args)
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        tabs = executor.submit(sheets_read, get_tabs, spreadsheet_id)
+        modified_time = executor.submit(drive_read, get_modified_time, spreadsheet_id)
+        
+        # Without a valid mirror the sheet is read back, and that needs both invoice listings
+        invoice_links = None
+        if mirror is None or mirror["modified_time"] != modified_time.result():
+            mirror = None
+            invoice_links = (executor.submit(drive_read, get_invoice_links, seller.a_invoices_folder_id),
+                             executor.submit(drive_read, get_invoice_links, seller.b_invoices_folder_id))
+        
+        if sheet_name not in tabs.result():
+            return SheetSetup(creds, False)
+    
+    return SheetSetup(creds, True, mirror, invoice_links and (invoice_links[0].result(), invoice_links[1].result()))
+
+def sweep(s: MeliSession, seller: Seller, creds: Credentials | None = None) -> dict:
+    swept_at = datetime.now(tz=BS_AS_TZ)
+    cancellations = collect_cancellations(s, seller.user_id, seller.db_dir, load_sweep_state(seller.db_dir)["last_swept"])
+    
+    swept = {}
+    for month, cancelled_sales in cancellations.items():
+        with month_lock(seller.db_dir, month):
+            newly_cancelled = mark_cancelled(seller.db_dir, month, cancelled_sales)
+        if newly_cancelled:
+            swept[month] = len(newly_cancelled)
+    
+    # Every store is up to date, what is left is tracked as stale months
+    save_last_swept(seller.db_dir, swept_at)
+    
+    tab_months = get_tab_months(seller)
+    for month in load_sweep_state(seller.db_dir)["stale_months"]:
+        start = datetime.strptime(month, "%B_%y").replace(tzinfo=BS_AS_TZ)
+        
+        with month_lock(seller.db_dir, month):
+            d = load_month(seller.db_dir, month)
+            record = d["sales"]
+            # mark_cancelled saved the month's totals with its sales, they only need publishing
+            update_totals(seller.db_dir, month, apply_totals_delta(d))
+            
+            # Tabs reused by a later year or moved to the archive are left alone
+            if tab_months.get((get_spreadsheet_id(seller, start.year), get_sheet_name(seller, start.month))) == start.replace(tzinfo=None):
+                creds = creds or get_google_credentials()
+                setup = prepare_sheet(seller, start, creds)
+                if setup.tab_exists:
+                    write_month(creds, seller, start, record, setup)
+            
+            remove_stale_month(seller.db_dir, month)
+    
+    return swept
+
+def get_google_credentials() -> Credentials:
+    # An expired refresh token is dropped and re-authorized inside get_credentials' lock
+    return get_credentials()
+
+def write_month(creds: Credentials, seller: Seller, start: datetime, record: list, setup: SheetSetup | None = None) -> None:
+    # Its tab lives in the archive now, recreating it here would split the month in two
+    if start.strftime("%B_%y").lower() in load_archived_months(seller.db_dir):
+        print(f"{seller.name}: {start:%B %Y} is archived, its tab is left as it is")
+        return
+    
     month_int = start.month
     month_spanish = month_to_spanish(month_int)
 
-    sheet_id = month_int - 1
-    sheet_name = f"Daniel - {month_spanish[:3].upper()}"
+    sheet_id = get_sheet_id(seller, start)
+    previous_tab = get_previous_tab(seller, start)
+    seller = replace(seller, spreadsheet_id=get_spreadsheet_id(seller, start.year))
+    sheet_name = get_sheet_name(seller, month_int)
 
-    record = update_json(s, USER_ID, start, end)
-    sales_df = create_sales_dataframe(record)
-    last_row_sales = len(sales_df) + 2
+    last_row_sales = len(record) + 2
 
-    try:
-        sheets_service, drive_service = authorize()
-    except RefreshError:
-        os.remove("google_creds/token.json")
-        sheets_service, drive_service = authorize()
+    sheets_service, drive_service = build_services(creds)
+    if setup is None:
+        setup = prepare_sheet(seller, start, creds)
 
-    try:
-        add_sheet(sheets_service, SPREADSHEET_ID, sheet_id, sheet_name)
-        sales_df, _ = modify_sales_dataframe(sales_df)
+    if not setup.tab_exists:
+        add_sheet(sheets_service, seller.spreadsheet_id, sheet_id, sheet_name)
+        sales_df, _ = modify_sales_dataframe(create_sales_dataframe(record), tab_prefix=seller.tab_prefix, previous_tab=previous_tab)
         cancellations_df = None
-    except HttpError as e:
-        done_invoices = get_done_invoices(sheets_service, SPREADSHEET_ID, last_row_sales, sheet_name)
-        invoice_numbers = get_invoice_numbers(sheets_service, SPREADSHEET_ID, last_row_sales, sheet_name)
-
-        a_invoice_links = get_invoice_links(drive_service, A_INVOICES_FOLDER_ID)
-        b_invoice_links = get_invoice_links(drive_service, B_INVOICES_FOLDER_ID)
-
-        invoice_links = []
-        a_invoice_index = 0
-        b_invoice_index = 0
-        for idx, (invoice, done) in enumerate(zip(invoice_numbers, done_invoices)):
-            if done:
-                if invoice[-1] == "A":
-                    while invoice[:-1] != a_invoice_links[a_invoice_index]["num"]:
-                        a_invoice_index += 1
-                    invoice_links.append(get_invoice_num_formula(url=a_invoice_links[a_invoice_index]["link"], num=invoice))
-                else:
-                    while invoice[:-1] != b_invoice_links[b_invoice_index]["num"]:
-                        b_invoice_index += 1
-                    invoice_links.append(get_invoice_num_formula(url=b_invoice_links[b_invoice_index]["link"], num=invoice))
-            else:
-                invoice_links.append(get_invoice_num_formula(row=idx+3, hyperlink=False))
+    else:
+        mirror = setup.mirror
 
-        sales_df, cancellations_info_df = modify_sales_dataframe(sales_df, done_invoices, invoice_links)
-        cancellations_df = create_cancellations_dataframe(cancellations_info_df, sheets_service, SPREADSHEET_ID, sheet_name, sheet_id, start)
+        # The orders can take minutes to download, a checkbox ticked meanwhile is only in the sheet
+        if mirror is not None and get_modified_time(drive_service, seller.spreadsheet_id) != mirror["modified_time"]:
+            mirror = None
 
-    sales = [[month_spanish.upper()]]
-    sales.append(sales_df.columns.values.tolist())
-    sales.extend(sales_df.values.tolist())
+        # Only append when the mirror proves the tab is unedited, still shows the stored rows and is styled the way this run styles
+        appended_from = len(mirror["done_invoices"]) if mirror is not None else None
+        if (appended_from is not None and appended_from <= len(record) and mirror.get("digest") == get_record_digest(record[:appended_from])
+                and mirror.get("static_row_styles") == seller.static_row_styles):
+            new_sales_df = append_sales(sheets_service, seller, record, appended_from, sheet_name, sheet_id, previous_tab)
+            if new_sales_df is not None:
+                mirror["done_invoices"].extend(new_sales_df["FACTURA EMITIDA"].tolist())
+                mirror["invoice_links"].extend(new_sales_df["Nº FACTURA"].tolist())
+            finish_sync(sheets_service, drive_service, seller, sheet_name, record, mirror["done_invoices"], mirror["invoice_links"])
+            return
+        
+        sales_df = create_sales_dataframe(record)
+        
+        if mirror is not None:
+            done_invoices = mirror["done_invoices"]
+            invoice_links = mirror["invoice_links"]
+            # Our last write left every FACTURA ANULADA checkbox unticked
+            cancelled_invoices = []
+        else:
+            done_invoices, invoice_numbers, a_invoice_links, b_invoice_links = read_sheet_state(creds, seller.spreadsheet_id, last_row_sales, sheet_name, seller.a_invoices_folder_id, seller.b_invoices_folder_id, setup.invoice_links)
+            invoice_links = match_invoice_links(invoice_numbers, done_invoices, a_invoice_links, b_invoice_links, seller.tab_prefix, previous_tab)
+            cancelled_invoices = None
+
+        sales_df, cancellations_info_df = modify_sales_dataframe(sales_df, done_invoices, invoice_links, tab_prefix=seller.tab_prefix, previous_tab=previous_tab)
+        cancellations_df = create_cancellations_dataframe(cancellations_info_df, sheets_service, seller.spreadsheet_id, sheet_name, sheet_id, start, seller.db_dir, cancelled_invoices)
+
+    sales = create_sales_matrix(sales_df, month_spanish)
+    customers = sales_df["DATOS CLIENTE"].tolist() if seller.static_row_styles else None
 
     if cancellations_df is not None:
         last_row_cancellations = len(cancellations_df) + 2
-        cancellations = [cancellations_df.columns.values.tolist()]
-        cancellations.extend(cancellations_df.values.tolist())
-        write_to_sheet(sheets_service, SPREADSHEET_ID, sales, last_row_sales, sheet_name, cancellations, last_row_cancellations)
-        format_sheet(sheets_service, SPREADSHEET_ID, last_row_sales, sheet_id, last_row_cancellations)
+        cancellations = create_cancellations_matrix(cancellations_df)
+        cancellations_customers = cancellations_df["DATOS CLIENTE"].tolist() if seller.static_row_styles else None
+        write_to_sheet(sheets_service, seller.spreadsheet_id, sales, last_row_sales, sheet_name, cancellations, last_row_cancellations)
+        format_sheet(sheets_service, seller.spreadsheet_id, last_row_sales, sheet_id, last_row_cancellations, customers, cancellations_customers)
     else:
-        write_to_sheet(sheets_service, SPREADSHEET_ID, sales, last_row_sales, sheet_name)
-        format_sheet(sheets_service, SPREADSHEET_ID, last_row_sales, sheet_id)
+        write_to_sheet(sheets_service, seller.spreadsheet_id, sales, last_row_sales, sheet_name)
+        format_sheet(sheets_service, seller.spreadsheet_id, last_row_sales, sheet_id, customers=customers)
+
+    finish_sync(sheets_service, drive_service, seller, sheet_name, record, sales_df["FACTURA EMITIDA"].tolist(), sales_df["Nº FACTURA"].tolist())
 
 if __name__ == "__main__":
     start, end = get_month()
-    main(start, end)
\ No newline at end of file
+    hedger = create_hedger()
+    try:
+        main(start, end, default_seller(), hedger=hedger)
+    finally:
+        if hedger is not None:
+            print(hedger.summary())
+            hedger.close()
\ No newline at end of file
@@ -0,0 +1,128 @@
+import sys
+import sqlite3
+from datetime import datetime, timezone
+
+from src.store import list_months, load_month
+
+SCHEMA_VERSION = 1
+
+def open_index(db_dir: str = "sales_db") -> sqlite3.Connection:
+    conn = sqlite3.connect(f"{db_dir}/orders.sqlite", timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY, month TEXT NOT NULL, row INTEGER NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS orders_month ON orders (month)")
+    migrate(conn, db_dir)
+    return conn
+
+def migrate(conn: sqlite3.Connection, db_dir: str) -> None:
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+
+    # Taking the write lock first keeps two runs from migrating at once
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        if version < 1:
+            columns = {column[1] for column in conn.execute("PRAGMA table_info(orders)")}
+            if "identification" not in columns:
+                conn.execute("ALTER TABLE orders ADD COLUMN identification TEXT")
+            if "sale_date" not in columns:
+                conn.execute("ALTER TABLE orders ADD COLUMN sale_date TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS orders_identification ON orders (identification)")
+            conn.execute("CREATE INDEX IF NOT EXISTS orders_sale_date ON orders (sale_date)")
+
+            # Orders indexed before these columns existed are filled in from their month
+            conn.execute("DELETE FROM orders")
+            for month in list_months(db_dir):
+                conn.executemany("INSERT OR REPLACE INTO orders (id, month, row, identification, sale_date) VALUES (?, ?, ?, ?, ?)",
+                                 get_rows(month, load_month(db_dir, month)["sales"]))
+
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def to_index_date(date: str | datetime) -> str:
+    # Stored in UTC so ranges compare as text whatever offset the API used
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return date.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+def get_rows(month: str, sales: list, first_row: int = 0) -> list:
+    return [(sale["id"], month, row, sale["identification"], to_index_date(sale["sale_date"])) for row, sale in enumerate(sales, start=first_row)]
+
+def get_locations(conn: sqlite3.Connection, ids: list) -> dict:
+    locations = {}
+    ids = list(ids)
+    # SQLite limits the number of bound parameters per statement
+    for i in range(0, len(ids), 900):
+        chunk = ids[i:i+900]
+        placeholders = ", ".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT id, month, row FROM orders WHERE id IN ({placeholders})", chunk)
+        locations.update({id : (month, row) for id, month, row in rows})
+    return locations
+
+def find_by_identification(conn: sqlite3.Connection, identification: str) -> list:
+    # Either the whole "CUIT 20123456789" or just the number, taken literally even if it has % or _
+    escaped = identification.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    rows = conn.execute("SELECT month, row FROM orders WHERE identification = ? OR identification LIKE ? ESCAPE '\\' ORDER BY sale_date",
+                        (identification, f"% {escaped}"))
+    return rows.fetchall()
+
+def find_by_date(conn: sqlite3.Connection, start: datetime | None = None, end: datetime | None = None) -> list:
+    # Open ends compare below and above every stored date
+    rows = conn.execute("SELECT month, row FROM orders WHERE sale_date >= ? AND sale_date < ? ORDER BY sale_date",
+                        (to_index_date(start) if start else "", to_index_date(end) if end else "9999"))
+    return rows.fetchall()
+
+def filter_new_sales(conn: sqlite3.Connection, month: str, sales: list) -> list:
+    locations = get_locations(conn, {sale["id"] for sale in sales})
+
+    new_sales = []
+    seen = set()
+    for sale in sales:
+        if sale["id"] in seen:
+            continue
+        seen.add(sale["id"])
+
+        if sale["id"] in locations and locations[sale["id"]][0] != month:
+            print(f"Sale {sale["id"]} is already stored in {locations[sale["id"]][0]}")
+            continue
+        new_sales.append(sale)
+
+    return new_sales
+
+def index_sales(conn: sqlite3.Connection, month: str, sales: list, first_row: int = 0) -> None:
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO orders (id, month, row, identification, sale_date) VALUES (?, ?, ?, ?, ?)",
+                         get_rows(month, sales, first_row))
+
+def index_month(conn: sqlite3.Connection, month: str, sales: list) -> None:
+    count = conn.execute("SELECT COUNT(*) FROM orders WHERE month = ?", (month,)).fetchone()[0]
+    if count == len(sales):
+        return
+
+    reindex_month(conn, month, sales)
+
+def reindex_month(conn: sqlite3.Connection, month: str, sales: list) -> None:
+    with conn:
+        conn.execute("DELETE FROM orders WHERE month = ?", (month,))
+    index_sales(conn, month, sales)
+
+def rebuild_index(db_dir: str = "sales_db") -> int:
+    conn = open_index(db_dir)
+
+    months = 0
+    for month in list_months(db_dir):
+        index_month(conn, month, load_month(db_dir, month)["sales"])
+        months += 1
+
+    conn.close()
+
+    return months
+
+if __name__ == "__main__":
+    db_dir = sys.argv[1] if len(sys.argv) > 1 else "sales_db"
+    print(f"Indexed {rebuild_index(db_dir)} month(s)")
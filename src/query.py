@@ -0,0 +1,172 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from contextlib import closing
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from src.order_index import open_index, get_locations, reindex_month, find_by_identification, find_by_date
+from src.sellers import Seller, default_seller, load_sellers
+from src.shards import get_spreadsheet_id, get_sheet_name, get_tab_months
+from src.sheets import load_mirror
+from src.store import get_month_path, load_month
+
+BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
+
+class SalesQuery:
+    def __init__(self, seller: Seller) -> None:
+        self.seller = seller
+        self.db_dir = seller.db_dir
+
+        self._months = {}
+        self._lock = threading.Lock()
+
+        # Migrates the index once, lookups then open it read-only
+        open_index(self.db_dir).close()
+
+    def get_sale(self, order_id: int) -> dict | None:
+        with closing(self._connect()) as conn:
+            sale, month = self._locate_sale(conn, order_id)
+
+        if sale is not None or month is None:
+            return sale
+
+        # The index is behind its month, it's rebuilt from the stored sales and asked again
+        with closing(open_index(self.db_dir)) as conn:
+            reindex_month(conn, month, self._load_month(month))
+            sale, _ = self._locate_sale(conn, order_id)
+        return sale
+
+    def find_sales(self, identification: str | None = None, start: datetime | None = None, end: datetime | None = None) -> list:
+        with closing(self._connect()) as conn:
+            if identification is not None:
+                locations = find_by_identification(conn, identification)
+                if start is not None or end is not None:
+                    in_range = set(find_by_date(conn, start, end))
+                    locations = [location for location in locations if location in in_range]
+            else:
+                locations = find_by_date(conn, start, end)
+
+        return self._get_sales(locations)
+
+    def get_pending_invoices(self, month: str) -> list:
+        date = datetime.strptime(month, "%B_%y")
+        spreadsheet_id = get_spreadsheet_id(self.seller, date.year)
+        sheet_name = get_sheet_name(self.seller, date.month)
+
+        mirror = load_mirror(self.db_dir, spreadsheet_id, sheet_name)
+        # A reused tab holds a later year, its checkboxes say nothing about this month
+        if mirror is None or get_tab_months(self.seller).get((spreadsheet_id, sheet_name)) != date:
+            raise LookupError(f"{month} has no local copy of its tab, sync it first")
+
+        done_invoices = mirror["done_invoices"]
+        sales = self._load_month(month)
+        # Rows appended after the last sync haven't been invoiced yet
+        return [{**sale, "month" : month} for row, sale in enumerate(sales)
+                if not sale["cancelled"] and not (row < len(done_invoices) and done_invoices[row])]
+
+    def _locate_sale(self, conn: sqlite3.Connection, order_id: int) -> tuple[dict | None, str | None]:
+        locations = get_locations(conn, [order_id])
+        if order_id not in locations:
+            return None, None
+
+        month, row = locations[order_id]
+        sales = self._load_month(month)
+        if row < len(sales) and sales[row]["id"] == order_id:
+            return {**sales[row], "month" : month}, month
+        return None, month
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.db_dir}/orders.sqlite?mode=ro", uri=True, timeout=30)
+
+    def _get_sales(self, locations: list) -> list:
+        return [{**self._load_month(month)[row], "month" : month} for month, row in locations]
+
+    def _load_month(self, month: str) -> list:
+        # Months are reloaded only after a sync rewrites them
+        mtime = os.path.getmtime(get_month_path(self.db_dir, month))
+        with self._lock:
+            if month in self._months and self._months[month][0] == mtime:
+                return self._months[month][1]
+
+        sales = load_month(self.db_dir, month)["sales"]
+        with self._lock:
+            self._months[month] = (mtime, sales)
+        return sales
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # GET /orders/<id>
+    # GET /orders?identification=<CUIT or DNI>&from=YYYY-MM-DD&to=YYYY-MM-DD
+    # GET /pending?month=september_24
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = {key : values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+
+        try:
+            if len(parts) == 2 and parts[0] == "orders":
+                sale = self.server.query.get_sale(int(parts[1]))
+                if sale is None:
+                    return self.send_json(404, {"error" : f"order {parts[1]} is not stored"})
+                return self.send_json(200, sale)
+            elif parts == ["orders"]:
+                if not {"identification", "from", "to"} & params.keys():
+                    return self.send_json(400, {"error" : "filter by identification, from or to"})
+                start = parse_day(params["from"]) if "from" in params else None
+                end = parse_day(params["to"]) + timedelta(days=1) if "to" in params else None
+                return self.send_json(200, self.server.query.find_sales(params.get("identification"), start, end))
+            elif parts == ["pending"]:
+                month = params.get("month") or datetime.now(tz=BS_AS_TZ).strftime("%B_%y").lower()
+                return self.send_json(200, self.server.query.get_pending_invoices(month))
+        except ValueError as e:
+            return self.send_json(400, {"error" : str(e)})
+        except LookupError as e:
+            return self.send_json(404, {"error" : str(e)})
+
+        self.send_json(404, {"error" : f"unknown path {url.path}"})
+
+    def send_json(self, status: int, body) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def parse_day(day: str) -> datetime:
+    return datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=BS_AS_TZ)
+
+def create_server(query: SalesQuery, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.query = query
+    return server
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sellers", help="sellers.json to serve one of its sellers instead of the .env one")
+    parser.add_argument("--seller", help="name of the seller to serve from --sellers")
+    args = parser.parse_args()
+
+    if args.sellers:
+        sellers = load_sellers(args.sellers)
+        seller = next((seller for seller in sellers if seller.name == args.seller), sellers[0])
+    else:
+        seller = default_seller()
+
+    server = create_server(SalesQuery(seller), args.host, args.port)
+    print(f"Serving {seller.name} sales on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
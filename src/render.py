@@ -0,0 +1,182 @@
+import os
+import re
+import csv
+import json
+import argparse
+from datetime import datetime
+
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.worksheet.datavalidation import DataValidation
+from openpyxl.utils import get_column_letter
+
+from src.sales import create_sales_dataframe
+from src.sheets import (
+    BLACK,
+    WHITE,
+    RED,
+    GREEN,
+    SALES_COLUMNS,
+    SALES_COLUMNS_WIDTH,
+    CANCELLATIONS_COLUMNS_WIDTH,
+    modify_sales_dataframe,
+    get_pending_cancellations,
+    rename_cancellations_dataframe,
+    create_sales_matrix,
+    create_cancellations_matrix,
+    load_mirror
+    )
+from src.sellers import Seller, default_seller, load_sellers
+from src.shards import get_spreadsheet_id, get_sheet_name, get_tab_months
+from src.store import read_snapshot
+from src.utils import month_to_spanish
+
+HYPERLINK_FORMULA = re.compile(r'^=HYPERLINK\("(?P<url>[^"]*)"; "(?P<num>[^"]*)"\)$')
+
+def to_hex(color: dict) -> str:
+    return "".join(f"{round(color[channel] * 255):02X}" for channel in ["red", "green", "blue"])
+
+def create_matrices(record: list, month_int: int, done_invoices: list | None = None, invoice_links: list | None = None, cancelled_indices: list | None = None, tab_prefix: str = "Daniel") -> tuple[list, list | None]:
+    # A month without sales still gets its headers, like the tab does
+    if not record:
+        return [[month_to_spanish(month_int).upper()], list(SALES_COLUMNS.values())], None
+
+    sales_df, cancellations_info_df = modify_sales_dataframe(create_sales_dataframe(record), done_invoices, invoice_links, tab_prefix=tab_prefix)
+    cancellations_df = rename_cancellations_dataframe(get_pending_cancellations(cancellations_info_df, cancelled_indices or []))
+
+    sales = create_sales_matrix(sales_df, month_to_spanish(month_int))
+    cancellations = create_cancellations_matrix(cancellations_df) if cancellations_df is not None else None
+
+    return sales, cancellations
+
+def create_grid(sales: list, cancellations: list | None = None) -> list:
+    grid = [list(row) + [""] * (11 - len(row)) for row in sales]
+
+    if cancellations:
+        for idx, row in enumerate(cancellations, start=1):
+            if idx >= len(grid):
+                grid.append([""] * 11)
+            grid[idx] = grid[idx] + [""] + list(row)
+
+    return grid
+
+def render_csv(path: str, sales: list, cancellations: list | None = None) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerows(create_grid(sales, cancellations))
+
+def render_xlsx(path: str, sales: list, cancellations: list | None = None) -> None:
+    wb = Workbook()
+    ws = wb.active
+    ws.title = sales[0][0]
+
+    last_row = len(sales)
+    centered = Alignment(horizontal="center", vertical="center", wrap_text=False)
+    header_fill = PatternFill("solid", fgColor=to_hex(BLACK))
+    header_font = Font(name="Calibri", size=11, bold=True, color=to_hex(WHITE))
+
+    for row_idx, row in enumerate(create_grid(sales, cancellations), start=1):
+        for col_idx, value in enumerate(row, start=1):
+            if value == "":
+                continue
+
+            cell = ws.cell(row=row_idx, column=col_idx)
+            link = HYPERLINK_FORMULA.match(value) if isinstance(value, str) else None
+            if link:
+                cell.value = link["num"]
+                cell.hyperlink = link["url"]
+            else:
+                cell.value = value
+                # Sheets formulas use ; as separator, keep them as text instead of broken Excel formulas
+                if isinstance(value, str) and value.startswith("="):
+                    cell.data_type = "s"
+
+            cell.alignment = centered
+            cell.font = Font(name="Calibri", size=11)
+
+    ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=11)
+    for col_idx in range(1, 12):
+        for row_idx in [1, 2]:
+            ws.cell(row=row_idx, column=col_idx).fill = header_fill
+            ws.cell(row=row_idx, column=col_idx).font = header_font
+        ws.column_dimensions[get_column_letter(col_idx)].width = SALES_COLUMNS_WIDTH[col_idx - 1] / 7
+
+    checkboxes = DataValidation(type="list", formula1='"TRUE,FALSE"')
+    ws.add_data_validation(checkboxes)
+
+    for row_idx in range(3, last_row + 1):
+        ws.cell(row=row_idx, column=9).number_format = "#,##0.00"
+
+    rules = [
+        ("ISNUMBER(SEARCH(\"CANCELADA\",$C3))", PatternFill("solid", bgColor=to_hex(RED)), None),
+        ("AND($B3=TRUE,OR($C3=$C2,$C3=$C4))", PatternFill("solid", bgColor=to_hex(GREEN)), Font(bold=True)),
+        ("$B3=TRUE", PatternFill("solid", bgColor=to_hex(GREEN)), None),
+        ("OR($C3=$C2,$C3=$C4)", None, Font(bold=True))
+    ]
+    if last_row > 2:
+        checkboxes.add(f"B3:B{last_row}")
+        for formula, fill, font in rules:
+            ws.conditional_formatting.add(f"A3:K{last_row}", FormulaRule(formula=[formula], fill=fill, font=font, stopIfTrue=True))
+
+    if cancellations:
+        last_row_cancellations = len(cancellations) + 1
+        for col_idx in range(13, 17):
+            ws.cell(row=2, column=col_idx).fill = header_fill
+            ws.cell(row=2, column=col_idx).font = header_font
+            ws.column_dimensions[get_column_letter(col_idx)].width = CANCELLATIONS_COLUMNS_WIDTH[col_idx - 13] / 7
+
+        if last_row_cancellations > 2:
+            checkboxes.add(f"N3:N{last_row_cancellations}")
+            ws.conditional_formatting.add(f"M3:P{last_row_cancellations}", FormulaRule(formula=["OR($O3=$O2,$O3=$O4)"], font=Font(bold=True)))
+
+    wb.save(path)
+
+def render(record: list, month_int: int, path: str, done_invoices: list | None = None, invoice_links: list | None = None, cancelled_indices: list | None = None, tab_prefix: str = "Daniel") -> None:
+    sales, cancellations = create_matrices(record, month_int, done_invoices, invoice_links, cancelled_indices, tab_prefix)
+
+    if path.endswith(".csv"):
+        render_csv(path, sales, cancellations)
+    else:
+        render_xlsx(path, sales, cancellations)
+
+def get_tab_mirror(seller: Seller, date: datetime) -> dict | None:
+    spreadsheet_id = get_spreadsheet_id(seller, date.year)
+    sheet_name = get_sheet_name(seller, date.month)
+
+    # The checkboxes only live in the tab, the mirror of its last sync is the local copy
+    mirror = load_mirror(seller.db_dir, spreadsheet_id, sheet_name)
+    if mirror is None or get_tab_months(seller).get((spreadsheet_id, sheet_name)) != date.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None):
+        return None
+    return mirror
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sales_path", help="month .json or .snapshot")
+    parser.add_argument("path", help=".xlsx or .csv to write")
+    parser.add_argument("--sellers", help="sellers.json to take the seller from instead of the .env")
+    parser.add_argument("--seller", help="name of the seller in --sellers")
+    args = parser.parse_args()
+
+    if args.sales_path.endswith(".snapshot"):
+        d = read_snapshot(args.sales_path)
+    else:
+        with open(args.sales_path, encoding="utf-8") as f:
+            d = json.load(f)
+
+    if args.sellers:
+        sellers = load_sellers(args.sellers)
+        seller = next((seller for seller in sellers if seller.name == args.seller), sellers[0])
+    else:
+        seller = default_seller()
+
+    # The file is named after the month it stores, even when the month has no sales yet
+    date = datetime.strptime(os.path.basename(args.sales_path).split(".")[0], "%B_%y")
+    mirror = get_tab_mirror(seller, date)
+    if mirror is None:
+        print(f"No local copy of the {date:%B %Y} tab, every invoice is rendered as pending")
+        mirror = {"done_invoices" : None, "invoice_links" : None}
+
+    render(d["sales"], date.month, args.path, mirror["done_invoices"], mirror["invoice_links"], d["info"].get("cancelled_indices"), seller.tab_prefix)
+
+if __name__ == "__main__":
+    main()
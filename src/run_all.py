@@ -0,0 +1,44 @@
+import os
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from requests.adapters import HTTPAdapter
+
+from src.hedging import Hedger, create_hedger
+from src.main import get_month, main
+from src.sellers import Seller, load_sellers
+
+def run_all(start: datetime, end: datetime, sellers: list[Seller], max_workers: int | None = None, hedger: Hedger | None = None) -> dict:
+    # One pool shared by every seller's session, sized so no thread waits for a connection
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(len(sellers), 10))
+
+    for seller in sellers:
+        os.makedirs(seller.db_dir, exist_ok=True)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(sellers)) as executor:
+        futures = {executor.submit(main, start, end, seller, adapter, hedger) : seller for seller in sellers}
+
+        for future in as_completed(futures):
+            seller = futures[future]
+            try:
+                future.result()
+                results[seller.name] = None
+                print(f"{seller.name}: OK")
+            except Exception as e:
+                results[seller.name] = e
+                print(f"{seller.name}: ERROR\n{traceback.format_exc()}")
+
+    adapter.close()
+
+    return results
+
+if __name__ == "__main__":
+    start, end = get_month()
+    # One hedger for every seller, so the cap on duplicate requests applies to the whole run
+    hedger = create_hedger()
+    run_all(start, end, load_sellers(), hedger=hedger)
+    if hedger is not None:
+        print(hedger.summary())
+        hedger.close()
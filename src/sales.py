@@ -1,4 +1,6 @@
+import os
 import json
+import sqlite3
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
@@ -6,132 +8,281 @@ import requests
 import pandas as pd
 import numpy as np
 
-from src.utils import to_meli_date_format
+from src.order_index import open_index, filter_new_sales, index_sales, index_month
+from src.store import load_month, save_month
+from src.totals import update_totals, apply_totals_delta
+from src.utils import A_INVOICE_TAX_STATUSES, to_meli_date_format
 
 BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
 
-def get_sales(s: requests.Session, user_id: int, start: datetime, end: datetime, offset: int = 0, cancelled: bool = False) -> list:
+# Everything create_sale_record and apply_changes read from an order, orders/search has no field selection so it's trimmed here
+ORDER_FIELDS = ["id", "status", "date_closed", "cancel_detail", "order_items", "paid_amount", "total_amount", "payments"]
+
+def get_sales(s: requests.Session, user_id: int, start: datetime, end: datetime, offset: int = 0, cancelled: bool = False, updated_from: str | datetime | None = None) -> list:
     url = "https://api.mercadolibre.com/orders/search"
     params = {"seller" : user_id,
               "order.date_closed.from" : to_meli_date_format(start), # TODO: date_created o date_closed?
               "order.date_closed.to": to_meli_date_format(end),
-              "offset" : offset}
+              "offset" : offset,
+              "attributes" : "results"} # Drops the paging envelope, not order fields
     
     if cancelled:
         params.update({"order.status" : "cancelled"})
+    
+    if updated_from:
+        params.update({"order.date_last_updated.from" : to_meli_date_format(updated_from)})
         
-    r = s.get(url=url, params=params)
+    # A change feed is keyed by its watermark and never asked for twice, so it skips the cache
+    r = s.get(url=url, params=params, max_age=None if updated_from else s.get_max_age(end))
  
-    return r.json()["results"]
+    return project_orders(s, r)
+
+def project_orders(s: requests.Session, r: requests.Response) -> list:
+    sales = [project_order(sale) for sale in r.json()["results"]]
+    s.record_projection(len(r.content), len(json.dumps(sales).encode("utf-8")))
+    return sales
 
-def get_buyer_info(s: requests.Session, sale_id: int) -> dict:
+def project_order(sale: dict) -> dict:
+    # Orders still come back whole, trimming them only keeps checkpoints and memory small
+    return {field : sale[field] for field in ORDER_FIELDS if field in sale}
+
+def get_updated_cancellations(s: requests.Session, user_id: int, updated_from: str | datetime) -> list:
+    # Every month at once, orders/search can't filter by cancellation date so date_last_updated stands in for it
+    url = "https://api.mercadolibre.com/orders/search"
+    
+    sales = []
+    offset = 0
+    while True:
+        params = {"seller" : user_id,
+                  "order.status" : "cancelled",
+                  "order.date_last_updated.from" : to_meli_date_format(updated_from),
+                  "offset" : offset,
+                  "attributes" : "results"}
+        
+        sales_batch = project_orders(s, s.get(url=url, params=params))
+        sales.extend(sales_batch)
+        if len(sales_batch) < 51:
+            break
+        offset += 51
+    
+    return sales
+
+def get_buyer_info(s: requests.Session, sale_id: int, max_age: int | None = None) -> dict:
     r = s.get(f"https://api.mercadolibre.com/orders/{sale_id}/billing_info",
-              headers={"X-Version" : "2"})
+              params={"attributes" : "buyer"},
+              headers={"X-Version" : "2"},
+              max_age=max_age,
+              hedge=True)
     return r.json()["buyer"]["billing_info"]    
 
-def create_record(s: requests.Session, user_id: int, start: datetime, end: datetime) -> list:    
+def get_all_sales(s: requests.Session, user_id: int, start: datetime, end: datetime, cancelled: bool = False, updated_from: str | datetime | None = None) -> list:
     sales = []
     offset = 0
     while True:
-        sales_batch = get_sales(s, user_id, start, end, offset)
+        sales_batch = get_sales(s, user_id, start, end, offset, cancelled, updated_from)
         sales.extend(sales_batch)
         if len(sales_batch) < 51:
             break
         offset += 51
-            
-    record = []
-    for sale in sales:
-        try:
-            id = sale["id"]
-            cancelled = True if sale["status"] == "cancelled" else False
-            cancellation_date = sale["cancel_detail"]["date"] if cancelled else None
-            sale_date = sale["date_closed"]
-            product = sale["order_items"][0]["item"]["title"]
-            quantity = sale["order_items"][0]["quantity"]
-            unit_price = sale["order_items"][0]["unit_price"]
-            shipping_cost = sale["paid_amount"] - sale["total_amount"] if not cancelled else sale["payments"][0]["shipping_cost"]
-            total = sale["paid_amount"] if not cancelled else unit_price * quantity + shipping_cost
-            
-            buyer = get_buyer_info(s, id)
-            name = f"{buyer["name"]} {buyer["last_name"]}" if "last_name" in buyer else buyer["name"]
-            identification = f"{buyer["identification"]["type"]} {buyer["identification"]["number"]}"
-            tax_status = buyer["taxes"]["taxpayer_type"]["description"]
-            address = f"{buyer["address"]["street_name"]} {buyer["address"]["street_number"]}, {buyer["address"]["city_name"]} - C.P.: {buyer["address"]["zip_code"]}, {buyer["address"]["state"]["name"]}"
-            jurisdiction = buyer["address"]["state"]["name"]
-            
-            if len(sale["payments"]) > 1:
-                print(f"Sale {id} has more than 1 payment")
-            if len(sale["order_items"]) > 1:
-                print(f"Sale {id} has more than 1 item")
-        except Exception as e:
-            print(f"{str(e)}\nSale ID: {id}")
-            with open(f"meli/json/{id}.json", "w", encoding="utf-8") as f:
-                json.dump(buyer, f, int=2)
-            raise Exception(e)
-            
-        record.append({
-            "id" : id,
-            "cancelled" : cancelled,
-            "cancellation_date" : cancellation_date,
-            "sale_date" : sale_date,
-            "product" : product,
-            "total" : total,
-            "quantity" : quantity,
-            "unit_price" : unit_price,
-            "shipping_cost" : shipping_cost,
-            "name" : name,
-            "identification" : identification,
-            "tax_status" : tax_status,
-            "address" : address,
-            "jurisdiction" : jurisdiction
-        })
-    
-    return record
-
-def update_cancelled(s: requests.Session, user_id: int, sales: list, start: datetime, end: datetime) -> list:
-    cancelled_sales = get_sales(s, user_id, start, end, cancelled=True)
-    cancelled_ids = [sale["id"] for sale in cancelled_sales]
-
-    cancelled_idx = 0
-    for sale in sales:
-        if sale["id"] in cancelled_ids:
-            sale["cancelled"] = True
-            sale["cancellation_date"] = cancelled_sales[cancelled_idx]["cancel_detail"]["date"]
-            cancelled_idx += 1
     
     return sales
 
-def update_json(s: requests.Session, user_id: int, start: datetime, end: datetime) -> list:
+def load_checkpoint(path: str) -> dict:
+    checkpoint = {"started" : None,
+                  "sales" : [],
+                  "offset" : 0,
+                  "listed" : False,
+                  "records" : {}}
+    
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError: # last line cut short by a crash
+                    break
+                
+                if "started" in entry:
+                    checkpoint["started"] = entry["started"]
+                elif "sales" in entry:
+                    checkpoint["sales"].extend(entry["sales"])
+                    checkpoint["offset"] = entry["offset"] + 51
+                elif "listed" in entry:
+                    checkpoint["listed"] = True
+                elif "record" in entry:
+                    checkpoint["records"][entry["record"]["id"]] = entry["record"]
+    except FileNotFoundError:
+        pass
+    
+    return checkpoint
+
+def write_checkpoint(f, entry: dict) -> None:
+    f.write(json.dumps(entry) + "\n")
+    f.flush()
+
+def create_record(s: requests.Session, user_id: int, start: datetime, end: datetime, checkpoint_path: str | None = None, index: sqlite3.Connection | None = None, month: str | None = None) -> list:    
+    if checkpoint_path is None:
+        sales = get_all_sales(s, user_id, start, end)
+        if index is not None:
+            sales = filter_new_sales(index, month, sales)
+        return [create_sale_record(s, sale) for sale in sales]
+    
+    checkpoint = load_checkpoint(checkpoint_path)
+    sales = checkpoint["sales"]
+    records = checkpoint["records"]
+    
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        if checkpoint["started"] is None:
+            write_checkpoint(f, {"started" : to_meli_date_format(datetime.now(tz=BS_AS_TZ))})
+        
+        offset = checkpoint["offset"]
+        while not checkpoint["listed"]:
+            sales_batch = get_sales(s, user_id, start, end, offset)
+            sales.extend(sales_batch)
+            write_checkpoint(f, {"sales" : sales_batch, "offset" : offset})
+            if len(sales_batch) < 51:
+                write_checkpoint(f, {"listed" : True})
+                break
+            offset += 51
+        
+        if index is not None:
+            sales = filter_new_sales(index, month, sales)
+        
+        for sale in sales:
+            if sale["id"] not in records:
+                records[sale["id"]] = create_sale_record(s, sale)
+                write_checkpoint(f, {"record" : records[sale["id"]]})
+    
+    return [records[sale["id"]] for sale in sales]
+
+def get_checkpoint_start(path: str) -> str | None:
+    return load_checkpoint(path)["started"]
+
+def create_sale_record(s: requests.Session, sale: dict) -> dict:
+    buyer = None
+    try:
+        id = sale["id"]
+        cancelled = True if sale["status"] == "cancelled" else False
+        cancellation_date = sale["cancel_detail"]["date"] if cancelled else None
+        sale_date = sale["date_closed"]
+        product = sale["order_items"][0]["item"]["title"]
+        quantity = sale["order_items"][0]["quantity"]
+        unit_price = sale["order_items"][0]["unit_price"]
+        shipping_cost = sale["paid_amount"] - sale["total_amount"] if not cancelled else sale["payments"][0]["shipping_cost"]
+        total = sale["paid_amount"] if not cancelled else unit_price * quantity + shipping_cost
+        
+        buyer = get_buyer_info(s, id, s.get_max_age(datetime.fromisoformat(sale_date)))
+        name = f"{buyer["name"]} {buyer["last_name"]}" if "last_name" in buyer else buyer["name"]
+        identification = f"{buyer["identification"]["type"]} {buyer["identification"]["number"]}"
+        tax_status = buyer["taxes"]["taxpayer_type"]["description"]
+        address = f"{buyer["address"]["street_name"]} {buyer["address"]["street_number"]}, {buyer["address"]["city_name"]} - C.P.: {buyer["address"]["zip_code"]}, {buyer["address"]["state"]["name"]}"
+        jurisdiction = buyer["address"]["state"]["name"]
+        
+        if len(sale["payments"]) > 1:
+            print(f"Sale {id} has more than 1 payment")
+        if len(sale["order_items"]) > 1:
+            print(f"Sale {id} has more than 1 item")
+    except Exception as e:
+        sale_id = sale.get("id")
+        print(f"{str(e)}\nSale ID: {sale_id}")
+        os.makedirs("meli/json", exist_ok=True)
+        with open(f"meli/json/{sale_id}.json", "w", encoding="utf-8") as f:
+            json.dump({"sale" : sale, "buyer" : buyer}, f, indent=2)
+        raise
+        
+    return {
+        "id" : id,
+        "cancelled" : cancelled,
+        "cancellation_date" : cancellation_date,
+        "sale_date" : sale_date,
+        "product" : product,
+        "total" : total,
+        "quantity" : quantity,
+        "unit_price" : unit_price,
+        "shipping_cost" : shipping_cost,
+        "name" : name,
+        "identification" : identification,
+        "tax_status" : tax_status,
+        "address" : address,
+        "jurisdiction" : jurisdiction
+    }
+
+def apply_changes(s: requests.Session, user_id: int, sales: list, start: datetime, end: datetime, updated_from: str | datetime, index: sqlite3.Connection | None = None, month: str | None = None) -> list:
+    changed_sales = get_all_sales(s, user_id, start, end, updated_from=updated_from)
+    rows = {sale["id"] : idx for idx, sale in enumerate(sales)}
+    
+    new_sales = []
+    for sale in changed_sales:
+        if sale["id"] not in rows:
+            new_sales.append(sale)
+            continue
+        
+        # Orders can also come back from cancelled, the fetched status wins either way
+        stored_sale = sales[rows[sale["id"]]]
+        cancelled = sale["status"] == "cancelled"
+        if cancelled != stored_sale["cancelled"]:
+            stored_sale["cancelled"] = cancelled
+            stored_sale["cancellation_date"] = sale["cancel_detail"]["date"] if cancelled else None
+    
+    if index is not None:
+        new_sales = filter_new_sales(index, month, new_sales)
+    
+    new_sales.sort(key=lambda sale: datetime.fromisoformat(sale["date_closed"]))
+    sales.extend(create_sale_record(s, sale) for sale in new_sales)
+    
+    return sales
+
+def update_json(s: requests.Session, user_id: int, start: datetime, end: datetime, db_dir: str = "sales_db") -> list:
     now = datetime.now(tz=BS_AS_TZ)
     month = start.strftime("%B_%y").lower()
+    index = open_index(db_dir)
     
     try:
-        with open(f"sales_db/{month}.json", "r+", encoding="utf-8") as f:
-            d = json.load(f)
-            date_last_updated = d["info"]["date_last_updated"]
-            
-            if datetime.fromisoformat(date_last_updated) >= end:
-                d["sales"] = update_cancelled(s, user_id, d["sales"], start, end)
-            else:   
-                d["sales"] = update_cancelled(s, user_id, d["sales"], start, date_last_updated)
-                record = create_record(s, user_id, date_last_updated, end)
-                d["sales"].extend(record)
-
-            d["info"]["date_last_updated"] = to_meli_date_format(now)
-            
-            f.seek(0)
-            f.truncate(0)
-            json.dump(d, f, indent=2)    
+        d = load_month(db_dir, month)
     except FileNotFoundError:
-        record = create_record(s, user_id, start, end)
+        d = None
+    
+    if d is not None:
+        date_last_updated = d["info"]["date_last_updated"]
+        
+        stored_cancelled = [sale["cancelled"] for sale in d["sales"]]
+        
+        index_month(index, month, d["sales"])
+        d["sales"] = apply_changes(s, user_id, d["sales"], start, end, date_last_updated, index, month)
+        index_sales(index, month, d["sales"][len(stored_cancelled):], len(stored_cancelled))
+
+        restored_rows = [row for row, (sale, was_cancelled) in enumerate(zip(d["sales"], stored_cancelled)) if was_cancelled and not sale["cancelled"]]
+        cancelled_sales = [sale for sale, was_cancelled in zip(d["sales"], stored_cancelled) if sale["cancelled"] and not was_cancelled]
+        
+        # A restored order no longer has a cancellation to process on the tab
+        d["info"]["cancelled_indices"] = [row for row in d["info"]["cancelled_indices"] if row not in restored_rows]
+        d["info"]["pending_cancellations"] = [row for row in d["info"]["pending_cancellations"] if row not in restored_rows]
+
+        d["info"]["date_last_updated"] = to_meli_date_format(now)
+        month_totals = apply_totals_delta(d, d["sales"][len(stored_cancelled):], cancelled_sales, [d["sales"][row] for row in restored_rows])
+        
+        save_month(db_dir, month, d)
+        update_totals(db_dir, month, month_totals)
+    else:
+        checkpoint_path = f"{db_dir}/{month}.checkpoint.jsonl"
+        
+        # A resumed backfill only covers what changed since the interrupted run started
+        now = get_checkpoint_start(checkpoint_path) or now
+        record = create_record(s, user_id, start, end, checkpoint_path, index, month)
+        index_month(index, month, record)
         
         d = {"info" : {"date_last_updated" : to_meli_date_format(now),
                        "pending_cancellations" : [],
                        "cancelled_indices" : []},
              "sales" : record}        
+        month_totals = apply_totals_delta(d)
+        
+        save_month(db_dir, month, d)
+        update_totals(db_dir, month, month_totals)
         
-        with open(f"sales_db/{month}.json", "w", encoding="utf-8") as f:
-            json.dump(d, f, indent=2)
+        os.remove(checkpoint_path)
+    
+    index.close()
         
     return d["sales"]
 
@@ -144,7 +295,7 @@ def create_sales_dataframe(record: list) -> pd.DataFrame:
     
     df["customer_info"] = df["name"] + " - " + df["identification"] + "\n" + df["address"] + "\n" + df["tax_status"]
     
-    df["invoice_type"] = np.where(df["tax_status"].isin(["Monotributo", "IVA Responsable Inscripto"]), "A", "B")
+    df["invoice_type"] = np.where(df["tax_status"].isin(A_INVOICE_TAX_STATUSES), "A", "B")
     df["unit_price"] = np.where(df["invoice_type"] == "A", round(df["unit_price"] / 1.21, 2), df["unit_price"])
     df["shipping_cost"] = np.where(df["invoice_type"] == "A", round(df["shipping_cost"] / 1.21, 2), df["shipping_cost"])
     
@@ -0,0 +1,66 @@
+import os
+import json
+from dataclasses import dataclass, field
+
+from dotenv import find_dotenv, dotenv_values
+
+@dataclass
+class Seller:
+    name: str
+    app_id: str
+    secret_key: str
+    user_id: str
+    spreadsheet_id: str
+    a_invoices_folder_id: str
+    b_invoices_folder_id: str
+    tab_prefix: str
+    dotenv_path: str
+    db_dir: str = "sales_db"
+    static_row_styles: bool = False
+    spreadsheet_ids: dict = field(default_factory=dict)
+    archive_spreadsheet_id: str | None = None
+    # [[days since the month ended, seconds served from cache], ...], None keeps cache.FRESHNESS
+    cache_freshness: list | None = None
+
+def default_seller() -> Seller:
+    dotenv_path = find_dotenv()
+    env = dotenv_values(dotenv_path)
+    tab_prefix = env.get("TAB_PREFIX") or "Daniel"
+
+    return Seller(name=tab_prefix,
+                  app_id=env["APP_ID"],
+                  secret_key=env["SECRET_KEY"],
+                  user_id=env["USER_ID"],
+                  spreadsheet_id=env["SPREADSHEET_ID"],
+                  a_invoices_folder_id=env["A_INVOICES_FOLDER_ID"],
+                  b_invoices_folder_id=env["B_INVOICES_FOLDER_ID"],
+                  tab_prefix=tab_prefix,
+                  dotenv_path=dotenv_path,
+                  static_row_styles=env.get("STATIC_ROW_STYLES", "").lower() in ["1", "true", "yes"],
+                  spreadsheet_ids=json.loads(env.get("SPREADSHEET_IDS") or "{}"),
+                  archive_spreadsheet_id=env.get("ARCHIVE_SPREADSHEET_ID"),
+                  cache_freshness=json.loads(env.get("CACHE_FRESHNESS") or "null"))
+
+def load_sellers(path: str = "sellers.json") -> list[Seller]:
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    sellers = []
+    for seller in config:
+        env = dotenv_values(seller["env_file"])
+        sellers.append(Seller(name=seller["name"],
+                              app_id=env["APP_ID"],
+                              secret_key=env["SECRET_KEY"],
+                              user_id=env["USER_ID"],
+                              spreadsheet_id=seller["spreadsheet_id"],
+                              a_invoices_folder_id=seller["a_invoices_folder_id"],
+                              b_invoices_folder_id=seller["b_invoices_folder_id"],
+                              tab_prefix=seller.get("tab_prefix", seller["name"]),
+                              dotenv_path=seller["env_file"],
+                              db_dir=seller.get("db_dir", os.path.join("sales_db", seller["name"].lower())),
+                              static_row_styles=seller.get("static_row_styles", False),
+                              spreadsheet_ids=seller.get("spreadsheet_ids", {}),
+                              archive_spreadsheet_id=seller.get("archive_spreadsheet_id"),
+                              cache_freshness=seller.get("cache_freshness")))
+
+    return sellers
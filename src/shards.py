@@ -0,0 +1,199 @@
+import os
+import json
+import argparse
+from datetime import datetime
+
+from src.sellers import Seller, default_seller, load_sellers
+from src.sheets import get_credentials, build_services
+from src.store import list_months, get_lock_timeout
+from src.utils import month_to_spanish, file_lock
+
+def get_spreadsheet_id(seller: Seller, year: int) -> str:
+    return seller.spreadsheet_ids.get(str(year), seller.spreadsheet_id)
+
+def get_previous_tab(seller: Seller, start: datetime) -> tuple[str, str] | None:
+    previous = datetime(start.year - (start.month == 1), (start.month - 2) % 12 + 1, 1)
+    sheet_name = get_sheet_name(seller, previous.month)
+
+    if previous.strftime("%B_%y").lower() in load_archived_months(seller.db_dir):
+        return seller.archive_spreadsheet_id, get_archive_name(sheet_name, previous)
+
+    spreadsheet_id = get_spreadsheet_id(seller, previous.year)
+    return (spreadsheet_id, sheet_name) if spreadsheet_id != get_spreadsheet_id(seller, start.year) else None
+
+def get_sheet_id(seller: Seller, start: datetime) -> int:
+    # Yearly spreadsheets use yymm so a tab keeps a unique id once it is moved to the archive
+    if str(start.year) in seller.spreadsheet_ids:
+        return (start.year % 100) * 100 + start.month
+    return start.month - 1
+
+def get_sheet_name(seller: Seller, month_int: int) -> str:
+    return f"{seller.tab_prefix} - {month_to_spanish(month_int)[:3].upper()}"
+
+def get_archive_name(sheet_name: str, month: datetime) -> str:
+    return f"{sheet_name} {month:%y}"
+
+def load_archived_months(db_dir: str = "sales_db") -> list:
+    try:
+        with open(f"{db_dir}/archived.json", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def save_archived_month(db_dir: str, month: str) -> None:
+    with file_lock(f"{db_dir}/archived.json.lock", get_lock_timeout()):
+        archived = load_archived_months(db_dir)
+        if month not in archived:
+            archived.append(month)
+
+        tmp_path = f"{db_dir}/archived.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(archived, f, indent=2)
+        os.replace(tmp_path, f"{db_dir}/archived.json")
+
+def get_synced_months(db_dir: str) -> list[datetime]:
+    return [datetime.strptime(month, "%B_%y") for month in list_months(db_dir)]
+
+def get_tab_months(seller: Seller) -> dict:
+    # Without yearly spreadsheets a tab is reused every year, so it holds the latest month synced under its name
+    tabs = {}
+    for month in get_synced_months(seller.db_dir):
+        tabs[(get_spreadsheet_id(seller, month.year), get_sheet_name(seller, month.month))] = month
+    return tabs
+
+def get_tabs(service, spreadsheet_id: str) -> dict:
+    r = service.spreadsheets().get(spreadsheetId=spreadsheet_id,
+                                   fields="sheets.properties(sheetId,title)").execute()
+
+    return {sheet["properties"]["title"] : sheet["properties"]["sheetId"] for sheet in r.get("sheets", [])}
+
+def freeze_formulas(service, spreadsheet_id: str, sheet_name: str) -> int:
+    ranges = {}
+    for render_option in ["FORMULA", "FORMATTED_VALUE"]:
+        r = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
+                                                range=f"'{sheet_name}'!J3:J",
+                                                majorDimension="COLUMNS",
+                                                valueRenderOption=render_option,
+                                                fields="values").execute()
+        try:
+            ranges[render_option] = r["values"][0]
+        except KeyError:
+            ranges[render_option] = []
+
+    # Invoice numbers still being worked out look up the previous tab, which won't exist next to them in the archive
+    data = [
+        {
+            "range" : f"'{sheet_name}'!J{idx+3}",
+            "values" : [[value]]
+        }
+        for idx, (formula, value) in enumerate(zip(ranges["FORMULA"], ranges["FORMATTED_VALUE"]))
+        if str(formula).startswith("=LET(")
+    ]
+
+    if data:
+        service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id,
+                                                    body={"valueInputOption" : "RAW", "data" : data},
+                                                    fields="spreadsheetId").execute()
+
+    return len(data)
+
+def archive_tab(service, spreadsheet_id: str, sheet_id: int, sheet_name: str, archive_spreadsheet_id: str, archive_name: str) -> None:
+    freeze_formulas(service, spreadsheet_id, sheet_name)
+
+    r = service.spreadsheets().sheets().copyTo(spreadsheetId=spreadsheet_id,
+                                               sheetId=sheet_id,
+                                               body={"destinationSpreadsheetId" : archive_spreadsheet_id},
+                                               fields="sheetId").execute()
+
+    rename = {
+        "requests" : [
+            {
+                "updateSheetProperties" : {
+                    "properties" : {
+                        "sheetId" : r["sheetId"],
+                        "title" : archive_name
+                    },
+                    "fields" : "title"
+                }
+            }
+        ]
+    }
+
+    service.spreadsheets().batchUpdate(spreadsheetId=archive_spreadsheet_id,
+                                       body=rename,
+                                       fields="spreadsheetId").execute()
+
+    delete = {
+        "requests" : [
+            {
+                "deleteSheet" : {
+                    "sheetId" : sheet_id
+                }
+            }
+        ]
+    }
+
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
+                                       body=delete,
+                                       fields="spreadsheetId").execute()
+
+def archive_months(seller: Seller, before: datetime, service=None) -> list:
+    if not seller.archive_spreadsheet_id:
+        raise ValueError(f"{seller.name} has no archive spreadsheet")
+
+    if service is None:
+        service, _ = build_services(get_credentials())
+
+    tab_months = get_tab_months(seller)
+    tabs = {month : tab for tab, month in tab_months.items()}
+
+    existing_tabs = {}
+    def get_tab_id(spreadsheet_id: str, sheet_name: str) -> int | None:
+        if spreadsheet_id not in existing_tabs:
+            existing_tabs[spreadsheet_id] = get_tabs(service, spreadsheet_id)
+        return existing_tabs[spreadsheet_id].get(sheet_name)
+
+    archived = []
+    for month in sorted(tabs):
+        if month >= before:
+            continue
+
+        spreadsheet_id, sheet_name = tabs[month]
+        sheet_id = get_tab_id(spreadsheet_id, sheet_name)
+        if sheet_id is None:
+            continue
+
+        # The next month's pending invoice numbers look this tab up by name, so they are frozen while it still exists
+        following = datetime(month.year + (month.month == 12), month.month % 12 + 1, 1)
+        if following in tabs and get_tab_id(*tabs[following]) is not None:
+            freeze_formulas(service, *tabs[following])
+
+        archive_name = get_archive_name(sheet_name, month)
+        archive_tab(service, spreadsheet_id, sheet_id, sheet_name, seller.archive_spreadsheet_id, archive_name)
+        save_archived_month(seller.db_dir, month.strftime("%B_%y").lower())
+        archived.append(archive_name)
+        print(f"{seller.name}: archived {sheet_name} as {archive_name}")
+
+    return archived
+
+def main() -> None:
+    now = datetime.now()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--before", help="archive months before this one (YYYY-MM), defaults to the previous month")
+    parser.add_argument("--sellers", help="sellers.json to archive every seller instead of the .env one")
+    args = parser.parse_args()
+
+    if args.before:
+        before = datetime.strptime(args.before, "%Y-%m")
+    else:
+        before = datetime(now.year - (now.month == 1), (now.month - 2) % 12 + 1, 1)
+
+    sellers = load_sellers(args.sellers) if args.sellers else [default_seller()]
+
+    service, _ = build_services(get_credentials())
+    for seller in sellers:
+        archive_months(seller, before, service)
+
+if __name__ == "__main__":
+    main()
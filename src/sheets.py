@@ -1,25 +1,77 @@
 import os
 import json
+import hashlib
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
 from copy import deepcopy
 
 import pandas as pd
 import numpy as np
 
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
-from src.utils import format_numbers, get_invoice_num_formula
+from src.store import load_month, save_month, get_lock_timeout
+from src.utils import format_numbers, get_invoice_num_formula, file_lock
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
 
 BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
 
-def modify_sales_dataframe(df: pd.DataFrame, done_invoices: list | None = None, invoice_links: list | None = None) -> pd.DataFrame:
+_authorize_lock = threading.Lock()
+_thread_services = threading.local()
+
+BLACK = {
+    "red" : 0,
+    "green" : 0,
+    "blue" : 0,
+    "alpha" : 1
+}
+
+WHITE = {
+    "red" : 1,
+    "green" : 1,
+    "blue" : 1,
+    "alpha" : 1
+}
+
+RED = {
+    "red" : 230/255,
+    "green" : 184/255,
+    "blue" : 175/255,
+    "alpha" : 1
+}
+
+GREEN = {
+    "red" : 217/255,
+    "green" : 234/255,
+    "blue" : 211/255,
+    "alpha" : 1
+}
+
+SALES_COLUMNS_WIDTH = [75, 35, 500, 35, 350, 35, 75, 75, 75, 50, 100]
+
+SALES_COLUMNS = {
+    "sale_date" : "FECHA VENTA",
+    "invoice_done" : "FACTURA EMITIDA",
+    "customer_info" : "DATOS CLIENTE",
+    "invoice_type" : "TIPO FACTURA",
+    "product" : "PRODUCTO",
+    "quantity" : "UNIDADES",
+    "unit_price" : "PRECIO UNITARIO",
+    "shipping_cost" : "ENVIO",
+    "total" : "TOTAL",
+    "invoice_number" : "Nº FACTURA",
+    "jurisdiction" : "JURISDICCION"
+}
+CANCELLATIONS_COLUMNS_WIDTH = [75, 35, 500, 50]
+
+def modify_sales_dataframe(df: pd.DataFrame, done_invoices: list | None = None, invoice_links: list | None = None, row_offset: int = 0, tab_prefix: str = "Daniel", previous_tab: tuple[str, str] | None = None) -> pd.DataFrame:
     df["customer_info"] = np.where(df["cancelled"], "CANCELADA\n" + df["customer_info"], df["customer_info"])
     
     if done_invoices:
@@ -37,83 +89,45 @@ def modify_sales_dataframe(df: pd.DataFrame, done_invoices: list | None = None,
     df["shipping_cost"] = format_numbers(df["shipping_cost"])
     
     if invoice_links:
-        invoice_links.extend([get_invoice_num_formula(row=row+3, hyperlink=False) for row in range(len(invoice_links), len(df))])
+        invoice_links.extend([get_invoice_num_formula(row=row+row_offset+3, hyperlink=False, tab_prefix=tab_prefix, previous_tab=previous_tab) for row in range(len(invoice_links), len(df))])
     else:
-        invoice_links = [get_invoice_num_formula(row=row+3, hyperlink=False) for row in range(len(df))]
+        invoice_links = [get_invoice_num_formula(row=row+row_offset+3, hyperlink=False, tab_prefix=tab_prefix, previous_tab=previous_tab) for row in range(len(df))]
     df["invoice_number"] = invoice_links
         
-    sales_df = df[["sale_date", "invoice_done", "customer_info", "invoice_type", "product", "quantity", "unit_price", "shipping_cost", "total", "invoice_number", "jurisdiction"]]
-    sales_df = sales_df.rename(columns={
-        "sale_date" : "FECHA VENTA",
-        "invoice_done" : "FACTURA EMITIDA",
-        "customer_info" : "DATOS CLIENTE",
-        "invoice_type" : "TIPO FACTURA",
-        "product" : "PRODUCTO",
-        "quantity" : "UNIDADES",
-        "unit_price" : "PRECIO UNITARIO",
-        "shipping_cost" : "ENVIO",
-        "total" : "TOTAL",
-        "invoice_number" : "Nº FACTURA",
-        "jurisdiction" : "JURISDICCION"
-    })
+    sales_df = df[list(SALES_COLUMNS)]
+    sales_df = sales_df.rename(columns=SALES_COLUMNS)
     
     cancellations_info_df = df[["invoice_done", "cancelled", "customer_info", "invoice_number", "cancellation_date"]]
 
     return sales_df, cancellations_info_df
 
-def create_cancellations_dataframe(info_df: pd.DataFrame, service, spreadsheet_id: str, sheet_name: str, sheet_id: int, start: datetime) -> pd.DataFrame | None:
-    month = start.strftime("%B_%y").lower()
-    
+def get_pending_cancellations(info_df: pd.DataFrame, cancelled_indices: list) -> pd.DataFrame:
     indices = []
     cancellations_dates = []
     customers_info = []
     invoices_numbers = []
     
-    with open(f"sales_db/{month}.json", "r+", encoding="utf-8") as f:
-        d = json.load(f)
-        
-        pending_cancellations = d["info"]["pending_cancellations"]
-        
-        cancelled_invoices = get_cancelled_invoices(service, spreadsheet_id, max(len(pending_cancellations) + 2, 3), sheet_name)
-        
-        clear_cancellations_range(service, spreadsheet_id, sheet_name, sheet_id, len(pending_cancellations) + 2)
-        
-        cancelled_indices = deepcopy(d["info"]["cancelled_indices"])
-        
-        new_cancelled_indices = []
-        for idx, cancelled in enumerate(cancelled_invoices):
-            if cancelled:
-                cancelled_indices.append(pending_cancellations[idx])
-                new_cancelled_indices.append(pending_cancellations[idx])
-                
-        d["info"]["cancelled_indices"].extend(new_cancelled_indices)
-                 
-        for row in range(len(info_df)):
-            if info_df.at[row, "invoice_done"] and info_df.at[row, "cancelled"] and row not in cancelled_indices:
-                indices.append(row)
-                cancellations_dates.append(info_df.at[row, "cancellation_date"])
-                customers_info.append(info_df.at[row, "customer_info"])
-                invoices_numbers.append(info_df.at[row, "invoice_number"])
-        
-        cancellations_df = pd.DataFrame({"indices" : indices,
-                                         "cancellation_date" : cancellations_dates,
-                                         "customer_info" : customers_info,
-                                         "invoice_number" : invoices_numbers})
-        
-        if len(cancellations_df) != 0:
-            cancellations_df["cancellation_date"] = pd.to_datetime(cancellations_df["cancellation_date"])
-            cancellations_df["cancellation_date"] = cancellations_df["cancellation_date"].dt.tz_convert("America/Argentina/Buenos_Aires")
-            cancellations_df = cancellations_df.sort_values(by="cancellation_date")
-            cancellations_df["cancellation_date"] = cancellations_df["cancellation_date"].dt.strftime("%d/%m/%y")
-            
-            d["info"]["pending_cancellations"] = cancellations_df["indices"].values.tolist()
-        else:
-            d["info"]["pending_cancellations"] = []
-        
-        f.seek(0)
-        f.truncate(0)
-        json.dump(d, f, indent=2)
+    for row in range(len(info_df)):
+        if info_df.at[row, "invoice_done"] and info_df.at[row, "cancelled"] and row not in cancelled_indices:
+            indices.append(row)
+            cancellations_dates.append(info_df.at[row, "cancellation_date"])
+            customers_info.append(info_df.at[row, "customer_info"])
+            invoices_numbers.append(info_df.at[row, "invoice_number"])
+    
+    cancellations_df = pd.DataFrame({"indices" : indices,
+                                     "cancellation_date" : cancellations_dates,
+                                     "customer_info" : customers_info,
+                                     "invoice_number" : invoices_numbers})
+    
+    if len(cancellations_df) != 0:
+        cancellations_df["cancellation_date"] = pd.to_datetime(cancellations_df["cancellation_date"])
+        cancellations_df["cancellation_date"] = cancellations_df["cancellation_date"].dt.tz_convert("America/Argentina/Buenos_Aires")
+        cancellations_df = cancellations_df.sort_values(by="cancellation_date")
+        cancellations_df["cancellation_date"] = cancellations_df["cancellation_date"].dt.strftime("%d/%m/%y")
     
+    return cancellations_df
+
+def rename_cancellations_dataframe(cancellations_df: pd.DataFrame) -> pd.DataFrame | None:
     if len(cancellations_df) == 0:
         return None
         
@@ -128,7 +142,80 @@ def create_cancellations_dataframe(info_df: pd.DataFrame, service, spreadsheet_i
     
     return cancellations_df
 
+def create_cancellations_dataframe(info_df: pd.DataFrame, service, spreadsheet_id: str, sheet_name: str, sheet_id: int, start: datetime, db_dir: str = "sales_db", cancelled_invoices: list | None = None) -> pd.DataFrame | None:
+    month = start.strftime("%B_%y").lower()
+    
+    d = load_month(db_dir, month)
+    
+    pending_cancellations = d["info"]["pending_cancellations"]
+    
+    if cancelled_invoices is None:
+        cancelled_invoices = get_cancelled_invoices(service, spreadsheet_id, max(len(pending_cancellations) + 2, 3), sheet_name)
+    
+    clear_cancellations_range(service, spreadsheet_id, sheet_name, sheet_id, len(pending_cancellations) + 2)
+    
+    cancelled_indices = deepcopy(d["info"]["cancelled_indices"])
+    
+    new_cancelled_indices = []
+    for idx, cancelled in enumerate(cancelled_invoices):
+        if cancelled:
+            cancelled_indices.append(pending_cancellations[idx])
+            new_cancelled_indices.append(pending_cancellations[idx])
+            
+    d["info"]["cancelled_indices"].extend(new_cancelled_indices)
+    
+    cancellations_df = get_pending_cancellations(info_df, cancelled_indices)
+    d["info"]["pending_cancellations"] = cancellations_df["indices"].values.tolist() if len(cancellations_df) != 0 else []
+    
+    save_month(db_dir, month, d)
+
+    return rename_cancellations_dataframe(cancellations_df)
+
+def create_sales_matrix(sales_df: pd.DataFrame, month_spanish: str) -> list:
+    sales = [[month_spanish.upper()]]
+    sales.append(sales_df.columns.values.tolist())
+    sales.extend(sales_df.values.tolist())
+    return sales
+
+def create_cancellations_matrix(cancellations_df: pd.DataFrame) -> list:
+    cancellations = [cancellations_df.columns.values.tolist()]
+    cancellations.extend(cancellations_df.values.tolist())
+    return cancellations
+
 def authorize():
+    return build_services(get_credentials())
+
+def build_services(creds: Credentials) -> tuple:
+    sheets_service = build("sheets", "v4", credentials=creds)
+    drive_service = build("drive", "v3", credentials=creds)
+    return sheets_service, drive_service
+
+def get_thread_services(creds: Credentials) -> tuple:
+    # httplib2 isn't thread-safe, so every thread gets its own clients
+    if getattr(_thread_services, "creds", None) is not creds:
+        _thread_services.creds = creds
+        _thread_services.services = build_services(creds)
+    return _thread_services.services
+
+def get_credentials() -> Credentials:
+    with _authorize_lock:
+        token = read_token()
+        try:
+            return load_credentials()
+        except RefreshError:
+            # Only the token that failed is dropped, one written meanwhile by another run is tried first
+            if read_token() == token and token is not None:
+                os.remove("google_creds/token.json")
+            return load_credentials()
+
+def read_token() -> str | None:
+    try:
+        with open("google_creds/token.json") as token:
+            return token.read()
+    except FileNotFoundError:
+        return None
+
+def load_credentials() -> Credentials:
     creds = None
     if os.path.exists("google_creds/token.json"):
         creds = Credentials.from_authorized_user_file("google_creds/token.json", SCOPES)
@@ -142,9 +229,7 @@ def authorize():
             creds = flow.run_local_server(port=0)
         with open("google_creds/token.json", "w") as token:
             token.write(creds.to_json())
-    sheets_service = build("sheets", "v4", credentials=creds)
-    drive_service = build("drive", "v3", credentials=creds)
-    return sheets_service, drive_service
+    return creds
 
 def add_sheet(service, spreadsheet_id: str, sheet_id: int, sheet_name: str) -> None:
     body = {
@@ -161,7 +246,8 @@ def add_sheet(service, spreadsheet_id: str, sheet_id: int, sheet_name: str) -> N
     }
     
     service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
-                                       body=body).execute()
+                                       body=body,
+                                       fields="spreadsheetId").execute()
 
 def write_to_sheet(service, spreadsheet_id: str, sales: list, last_row_sales: int, sheet_name: str, cancellations: list | None = None, last_row_cancellations: int | None = None) -> None:
     body = {
@@ -181,13 +267,22 @@ def write_to_sheet(service, spreadsheet_id: str, sales: list, last_row_sales: in
         })
 
     service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id,
-                                                body=body).execute()
+                                                body=body,
+                                                fields="spreadsheetId").execute()
+
+def write_new_rows(service, spreadsheet_id: str, rows: list, first_row: int, last_row: int, sheet_name: str) -> None:
+    service.spreadsheets().values().update(spreadsheetId=spreadsheet_id,
+                                           range=f"'{sheet_name}'!A{first_row}:K{last_row}",
+                                           valueInputOption="USER_ENTERED",
+                                           body={"values" : rows},
+                                           fields="spreadsheetId").execute()
 
 def get_done_invoices(service, spreadsheet_id: str, last_row: int, sheet_name: str) -> list:
     r = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
                                             range=f"'{sheet_name}'!B3:B{last_row}",
                                             majorDimension="COLUMNS",
-                                            valueRenderOption="UNFORMATTED_VALUE").execute()
+                                            valueRenderOption="UNFORMATTED_VALUE",
+                                            fields="values").execute()
     
     try:
         return r["values"][0]
@@ -198,7 +293,8 @@ def get_invoice_numbers(service, spreadsheet_id: str, last_row: int, sheet_name:
     r = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
                                             range=f"'{sheet_name}'!J3:J{last_row}",
                                             majorDimension="COLUMNS",
-                                            valueRenderOption="UNFORMATTED_VALUE").execute()
+                                            valueRenderOption="UNFORMATTED_VALUE",
+                                            fields="values").execute()
     
     try:
         return r["values"][0]
@@ -209,13 +305,32 @@ def get_cancelled_invoices(service, spreadsheet_id: str, last_row: int, sheet_na
     r = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
                                             range=f"'{sheet_name}'!N3:N{last_row}",
                                             majorDimension="COLUMNS",
-                                            valueRenderOption="UNFORMATTED_VALUE").execute()
+                                            valueRenderOption="UNFORMATTED_VALUE",
+                                            fields="values").execute()
     
     try:
         return r["values"][0]
     except KeyError:
         return []
 
+def read_sheet_state(creds: Credentials, spreadsheet_id: str, last_row: int, sheet_name: str, a_invoices_folder_id: str, b_invoices_folder_id: str, invoice_links: tuple[list, list] | None = None) -> tuple[list, list, list, list]:
+    def sheets_read(func, *args):
+        return func(get_thread_services(creds)[0], *args)
+    
+    def drive_read(func, *args):
+        return func(get_thread_services(creds)[1], *args)
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        done_invoices = executor.submit(sheets_read, get_done_invoices, spreadsheet_id, last_row, sheet_name)
+        invoice_numbers = executor.submit(sheets_read, get_invoice_numbers, spreadsheet_id, last_row, sheet_name)
+        # Listings fetched while the orders were downloading are reused
+        if invoice_links is None:
+            a_invoice_links = executor.submit(drive_read, get_invoice_links, a_invoices_folder_id)
+            b_invoice_links = executor.submit(drive_read, get_invoice_links, b_invoices_folder_id)
+            invoice_links = (a_invoice_links.result(), b_invoice_links.result())
+    
+    return done_invoices.result(), invoice_numbers.result(), *invoice_links
+
 def get_invoice_links(service, folder_id: str) -> list:
     r = service.files().list(q=f"'{folder_id}' in parents",
                             orderBy="name_natural desc",
@@ -228,39 +343,49 @@ def get_invoice_links(service, folder_id: str) -> list:
     
     return invoice_links
     
-def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, last_row_cancellations: int | None = None) -> None:
-    BLACK = {
-        "red" : 0,
-        "green" : 0,
-        "blue" : 0,
-        "alpha" : 1
-    }
-    
-    WHITE = {
-        "red" : 1,
-        "green" : 1,
-        "blue" : 1,
-        "alpha" : 1
-    }
-    
-    RED = {
-        "red" : 230/255,
-        "green" : 184/255,
-        "blue" : 175/255,
-        "alpha" : 1
-    }
-    
-    GREEN = {
-        "red" : 217/255,
-        "green" : 234/255,
-        "blue" : 211/255,
-        "alpha" : 1
-    }
-    
+def get_modified_time(drive_service, spreadsheet_id: str) -> str:
+    return drive_service.files().get(fileId=spreadsheet_id, fields="modifiedTime").execute()["modifiedTime"]
+
+def load_mirror(db_dir: str, spreadsheet_id: str, sheet_name: str) -> dict | None:
+    try:
+        with open(f"{db_dir}/sheet_mirror.json", encoding="utf-8") as f:
+            return json.load(f).get(f"{spreadsheet_id}!{sheet_name}")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def get_record_digest(record: list) -> str:
+    # Rows only ever change on the tab by being appended or cancelled
+    rows = [[sale["id"], sale["cancelled"], sale.get("cancellation_date")] for sale in record]
+    return hashlib.sha256(json.dumps(rows).encode()).hexdigest()
+
+def save_mirror(db_dir: str, spreadsheet_id: str, sheet_name: str, modified_time: str, record: list, done_invoices: list, invoice_links: list, static_row_styles: bool = False) -> None:
+    path = f"{db_dir}/sheet_mirror.json"
+    with file_lock(f"{path}.lock", get_lock_timeout()):
+        try:
+            with open(path, encoding="utf-8") as f:
+                mirrors = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            mirrors = {}
+        
+        mirrors[f"{spreadsheet_id}!{sheet_name}"] = {
+            "modified_time" : modified_time,
+            "digest" : get_record_digest(record),
+            "done_invoices" : [bool(done) for done in done_invoices],
+            "invoice_links" : invoice_links,
+            # Appending only extends the rules and formats of the mode the tab was last formatted in
+            "static_row_styles" : static_row_styles
+        }
+        
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(mirrors, f)
+        os.replace(f"{path}.tmp", path)
+
+def get_rows_format(sheet_id: int, first_row: int, last_row: int) -> list:
     general_format = {
         "repeatCell" : {
             "range" : {
                 "sheetId" : sheet_id,
+                "startRowIndex" : first_row,
                 "endRowIndex" : last_row,
                 "endColumnIndex" : 11
             },
@@ -279,40 +404,9 @@ def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, las
         }
     }
     
-    merge_title = {
-        "mergeCells" : {
-            "range" : {
-                "sheetId" : sheet_id,
-                "endRowIndex" : 1,
-                "endColumnIndex" : 11
-            },
-            "mergeType" : "MERGE_ROWS"
-        }
-    }
-    
-    headers_format = {
-        "repeatCell" : {
-            "range" : {
-                "sheetId" : sheet_id,
-                "endRowIndex" : 2,
-                "endColumnIndex" : 11
-            },
-            "cell" : {
-                "userEnteredFormat" : {
-                    "backgroundColor" : BLACK,
-                    "textFormat" : {
-                        "foregroundColor" : WHITE,
-                        "bold" : True
-                    }
-                }
-            },
-            "fields" : "userEnteredFormat.backgroundColor, userEnteredFormat.textFormat.foregroundColor, userEnteredFormat.textFormat.bold"
-        }
-    }
-   
     checkboxes_range = {
         "sheetId" : sheet_id,
-        "startRowIndex" : 2,
+        "startRowIndex" : max(first_row, 2),
         "endRowIndex" : last_row,
         "startColumnIndex" : 1,
         "endColumnIndex" : 2
@@ -348,7 +442,7 @@ def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, las
         "repeatCell" : {
             "range" : {
                 "sheetId" : sheet_id,
-                "startRowIndex" : 2,
+                "startRowIndex" : max(first_row, 2),
                 "endRowIndex" : last_row,
                 "startColumnIndex" : 8,
                 "endColumnIndex" : 9
@@ -365,36 +459,9 @@ def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, las
         }
     }
     
-    columns_width = [
-        {
-            "updateDimensionProperties" : {
-                "properties" : {
-                    "pixelSize" : width
-                },
-                "fields" : "pixelSize",
-                "range" : {
-                    "sheetId" : sheet_id,
-                    "dimension" : "COLUMNS",
-                    "startIndex" : idx,
-                    "endIndex" : idx+1
-                }
-            }
-        }
-        for idx, width in enumerate([75, 35, 500, 35, 350, 35, 75, 75, 75, 50, 100])
-    ]
-    
-    delete_conditional_formatting = {
-        "requests" : [
-            {
-                "deleteConditionalFormatRule" : {
-                    "index" : 0,
-                    "sheetId" : sheet_id
-                }
-            }
-            for _ in range(5)
-        ]
-    }
-    
+    return [general_format, checkboxes, checkboxes_format, total_format]
+
+def get_conditional_formatting_rules(sheet_id: int, last_row: int) -> list:
     rules = [
         {
             "value" : "=OR($C3=$C2; $C3=$C4)",
@@ -427,34 +494,257 @@ def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, las
         }
     ]
     
-    conditional_formatting = [
+    return [
         {
-            "addConditionalFormatRule" : {
-                "rule" : {
-                    "ranges" : [
+            "ranges" : [
+                {
+                    "sheetId" : sheet_id,
+                    "startRowIndex" : 2,
+                    "endRowIndex" : last_row,
+                    "endColumnIndex" : 11
+                }
+            ],
+            "booleanRule" : {
+                "condition" : {
+                    "type" : "CUSTOM_FORMULA",
+                    "values" : [
                         {
-                            "sheetId" : sheet_id,
-                            "startRowIndex" : 2,
-                            "endRowIndex" : last_row,
-                            "endColumnIndex" : 11
+                            "userEnteredValue" : rule["value"]
                         }
-                    ],
-                    "booleanRule" : {
-                        "condition" : {
-                            "type" : "CUSTOM_FORMULA",
-                            "values" : [
-                                {
-                                    "userEnteredValue" : rule["value"]
-                                }
-                            ]
-                        },
-                        "format" : rule["format"]
+                    ]
+                },
+                "format" : rule["format"]
+            }
+        }
+        for rule in rules
+    ]
+
+def get_row_styles(customers: list) -> tuple[list, list]:
+    # Same checks as the =OR($C3=$C2; $C3=$C4) and =REGEXMATCH($C3; "CANCELADA") rules, the header and the empty row below never match
+    duplicates = [(idx > 0 and customer == customers[idx-1]) or (idx < len(customers) - 1 and customer == customers[idx+1]) for idx, customer in enumerate(customers)]
+    cancelled = ["CANCELADA" in customer for customer in customers]
+    
+    return duplicates, cancelled
+
+def get_runs(flags: list, first_row: int) -> list:
+    runs = []
+    for idx, flag in enumerate(flags):
+        if not flag:
+            continue
+        if runs and runs[-1][1] == first_row + idx:
+            runs[-1][1] += 1
+        else:
+            runs.append([first_row + idx, first_row + idx + 1])
+    
+    return runs
+
+def get_static_format(sheet_id: int, first_row: int, bold: list, red: list, start_column: int = 0, end_column: int = 11) -> list:
+    reset_format = {
+        "repeatCell" : {
+            "range" : {
+                "sheetId" : sheet_id,
+                "startRowIndex" : first_row,
+                "endRowIndex" : first_row + len(bold),
+                "startColumnIndex" : start_column,
+                "endColumnIndex" : end_column
+            },
+            "cell" : {
+                "userEnteredFormat" : {
+                    "textFormat" : {
+                        "bold" : False
+                    }
+                }
+            },
+            "fields" : "userEnteredFormat.backgroundColor, userEnteredFormat.textFormat.bold"
+        }
+    }
+    
+    bold_format = [
+        {
+            "repeatCell" : {
+                "range" : {
+                    "sheetId" : sheet_id,
+                    "startRowIndex" : start,
+                    "endRowIndex" : end,
+                    "startColumnIndex" : start_column,
+                    "endColumnIndex" : end_column
+                },
+                "cell" : {
+                    "userEnteredFormat" : {
+                        "textFormat" : {
+                            "bold" : True
+                        }
+                    }
+                },
+                "fields" : "userEnteredFormat.textFormat.bold"
+            }
+        }
+        for start, end in get_runs(bold, first_row)
+    ]
+    
+    red_format = [
+        {
+            "repeatCell" : {
+                "range" : {
+                    "sheetId" : sheet_id,
+                    "startRowIndex" : start,
+                    "endRowIndex" : end,
+                    "startColumnIndex" : start_column,
+                    "endColumnIndex" : end_column
+                },
+                "cell" : {
+                    "userEnteredFormat" : {
+                        "backgroundColor" : RED
                     }
+                }
+            },
+            "fields" : "userEnteredFormat.backgroundColor"
+        }
+        for start, end in get_runs(red, first_row)
+    ]
+    
+    return [reset_format, *bold_format, *red_format]
+
+def get_live_formatting_rules(sheet_id: int, cancelled: list) -> list:
+    # Only the checkbox has to react while someone works on the sheet, cancelled rows stay red regardless
+    ranges = [
+        {
+            "sheetId" : sheet_id,
+            "startRowIndex" : start,
+            "endRowIndex" : end,
+            "endColumnIndex" : 11
+        }
+        for start, end in get_runs([not row for row in cancelled], 2)
+    ]
+    
+    if not ranges:
+        return []
+    
+    # Relative to the top-left cell of the first range, which starts lower when the first rows are cancelled
+    formula = f"=$B{ranges[0]["startRowIndex"] + 1}=TRUE"
+    
+    return [
+        {
+            "ranges" : ranges,
+            "booleanRule" : {
+                "condition" : {
+                    "type" : "CUSTOM_FORMULA",
+                    "values" : [
+                        {
+                            "userEnteredValue" : formula
+                        }
+                    ]
                 },
+                "format" : {
+                    "backgroundColor" : GREEN
+                }
+            }
+        }
+    ]
+
+def format_new_rows(service, spreadsheet_id: str, first_row: int, last_row: int, sheet_id: int, customers: list | None = None) -> None:
+    if customers is None:
+        rules = get_conditional_formatting_rules(sheet_id, last_row)
+        static_format = []
+    else:
+        duplicates, cancelled = get_row_styles(customers)
+        rules = get_live_formatting_rules(sheet_id, cancelled)
+        bold = [duplicate and not red for duplicate, red in zip(duplicates, cancelled)]
+        
+        # The row above may have just become a duplicate of the first new one
+        static_format = get_static_format(sheet_id, first_row, bold[first_row-2:], cancelled[first_row-2:])
+        if first_row > 2 and bold[first_row-3]:
+            static_format.extend(get_static_format(sheet_id, first_row - 1, [True], [False]))
+    
+    # format_sheet adds every rule at index 0, so they end up in reverse order
+    extend_conditional_formatting = [
+        {
+            "updateConditionalFormatRule" : {
+                "sheetId" : sheet_id,
+                "index" : len(rules) - 1 - idx,
+                "rule" : rule
+            }
+        }
+        for idx, rule in enumerate(rules)
+    ]
+    
+    # A tab where every row was cancelled has no live rule to update yet
+    if customers is not None and rules and all(cancelled[:first_row-2]):
+        extend_conditional_formatting = [{"addConditionalFormatRule" : {"rule" : rules[0], "index" : 0}}]
+    
+    body = {
+        "requests" : get_rows_format(sheet_id, first_row, last_row) + static_format + extend_conditional_formatting
+    }
+    
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
+                                       body=body,
+                                       fields="spreadsheetId").execute()
+
+def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, last_row_cancellations: int | None = None, customers: list | None = None, cancellations_customers: list | None = None) -> None:
+    merge_title = {
+        "mergeCells" : {
+            "range" : {
+                "sheetId" : sheet_id,
+                "endRowIndex" : 1,
+                "endColumnIndex" : 11
+            },
+            "mergeType" : "MERGE_ROWS"
+        }
+    }
+    
+    headers_format = {
+        "repeatCell" : {
+            "range" : {
+                "sheetId" : sheet_id,
+                "endRowIndex" : 2,
+                "endColumnIndex" : 11
+            },
+            "cell" : {
+                "userEnteredFormat" : {
+                    "backgroundColor" : BLACK,
+                    "textFormat" : {
+                        "foregroundColor" : WHITE,
+                        "bold" : True
+                    }
+                }
+            },
+            "fields" : "userEnteredFormat.backgroundColor, userEnteredFormat.textFormat.foregroundColor, userEnteredFormat.textFormat.bold"
+        }
+    }
+   
+    columns_width = [
+        {
+            "updateDimensionProperties" : {
+                "properties" : {
+                    "pixelSize" : width
+                },
+                "fields" : "pixelSize",
+                "range" : {
+                    "sheetId" : sheet_id,
+                    "dimension" : "COLUMNS",
+                    "startIndex" : idx,
+                    "endIndex" : idx+1
+                }
+            }
+        }
+        for idx, width in enumerate(SALES_COLUMNS_WIDTH)
+    ]
+    
+    # Formats a static run left behind are cleared when the tab goes back to the rules
+    static_format = get_static_format(sheet_id, 2, [False] * (last_row - 2), [False] * (last_row - 2))
+    if customers is not None:
+        duplicates, cancelled = get_row_styles(customers)
+        live_rules = get_live_formatting_rules(sheet_id, cancelled)
+        static_format = get_static_format(sheet_id, 2, [duplicate and not red for duplicate, red in zip(duplicates, cancelled)], cancelled)
+    
+    conditional_formatting = [
+        {
+            "addConditionalFormatRule" : {
+                "rule" : rule,
                 "index" : 0
             }
         }
-        for rule in rules
+        for rule in (get_conditional_formatting_rules(sheet_id, last_row) if customers is None else live_rules)
     ]
 
     if last_row_cancellations:
@@ -554,7 +844,7 @@ def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, las
                     }
                 }
             }
-            for idx, width in enumerate([75, 35, 500, 50])
+            for idx, width in enumerate(CANCELLATIONS_COLUMNS_WIDTH)
         ]
         
         cancellations_conditional_formatting = {
@@ -593,28 +883,53 @@ def format_sheet(service, spreadsheet_id: str, last_row: int, sheet_id: int, las
         "requests" : []
     }
     
-    for request in [general_format, merge_title, headers_format, checkboxes, checkboxes_format, total_format]:
+    for request in [merge_title, headers_format, *get_rows_format(sheet_id, 0, last_row)]:
         body["requests"].append(request)
     
     if last_row_cancellations:
-        for request in [cancellations_general_format, cancellations_headers_format, cancellations_checkboxes, cancellations_checkboxes_format, cancellations_columns_width, cancellations_conditional_formatting]:
+        if cancellations_customers is None:
+            cancellations_format = [*get_static_format(sheet_id, 2, [False] * (last_row_cancellations - 2), [False] * (last_row_cancellations - 2), 12, 16), cancellations_conditional_formatting]
+        else:
+            cancellations_format = get_static_format(sheet_id, 2, get_row_styles(cancellations_customers)[0], [False] * len(cancellations_customers), 12, 16)
+        
+        for request in [cancellations_general_format, cancellations_headers_format, cancellations_checkboxes, cancellations_checkboxes_format, cancellations_columns_width, *cancellations_format]:
             body["requests"].append(request)
     
+    if static_format:
+        body["requests"].extend(static_format)
+    
     body["requests"].extend(columns_width)
     body["requests"].extend(conditional_formatting)
     
-    try:
-        service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
-                                           body=delete_conditional_formatting).execute()
-    except HttpError:
-        pass
+    # Every rule this tab has is replaced, however many an earlier mode left behind
+    delete_conditional_formatting = [
+        {
+            "deleteConditionalFormatRule" : {
+                "index" : 0,
+                "sheetId" : sheet_id
+            }
+        }
+        for _ in range(get_conditional_format_count(service, spreadsheet_id, sheet_id))
+    ]
+    body["requests"] = delete_conditional_formatting + body["requests"]
     
     service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
-                                       body=body).execute()
+                                       body=body,
+                                       fields="spreadsheetId").execute()
+
+def get_conditional_format_count(service, spreadsheet_id: str, sheet_id: int) -> int:
+    r = service.spreadsheets().get(spreadsheetId=spreadsheet_id,
+                                   fields="sheets(properties.sheetId,conditionalFormats.ranges.sheetId)").execute()
+    
+    for sheet in r.get("sheets", []):
+        if sheet["properties"]["sheetId"] == sheet_id:
+            return len(sheet.get("conditionalFormats", []))
+    return 0
 
 def clear_cancellations_range(service, spreadsheet_id: str, sheet_name: str, sheet_id: int, last_row: int) -> None:
     service.spreadsheets().values().clear(spreadsheetId=spreadsheet_id,
-                                          range=f"'{sheet_name}'!M2:P{last_row}").execute()
+                                          range=f"'{sheet_name}'!M2:P{last_row}",
+                                          fields="spreadsheetId").execute()
     
     body = {
         "requests" : [
@@ -648,4 +963,5 @@ def clear_cancellations_range(service, spreadsheet_id: str, sheet_name: str, she
     }
     
     service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
-                                       body=body).execute()
\ No newline at end of file
+                                       body=body,
+                                       fields="spreadsheetId").execute()
\ No newline at end of file
@@ -0,0 +1,209 @@
+import os
+import gzip
+import json
+import time
+import struct
+import hashlib
+import argparse
+from glob import glob
+from datetime import datetime
+from itertools import repeat
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from src.utils import file_lock
+
+MAGIC = b"MLSDB\x03"
+HEADER = struct.Struct("<6sBQ32s")
+
+# Seconds to wait for another run holding a month, "none" waits forever and 0 fails right away
+DEFAULT_LOCK_TIMEOUT = 30 * 60
+
+CODECS = {
+    "none" : 0,
+    "gzip" : 1,
+    "zstd" : 2
+}
+
+def get_lock_timeout() -> float | None:
+    timeout = os.environ.get("SALES_DB_LOCK_TIMEOUT", "").strip().lower()
+    if not timeout:
+        return DEFAULT_LOCK_TIMEOUT
+    return None if timeout == "none" else float(timeout)
+
+def month_lock(db_dir: str, month: str):
+    return file_lock(f"{db_dir}/{month}.lock", get_lock_timeout())
+
+def get_default_compression() -> str:
+    return "zstd" if pa is not None and pa.Codec.is_available("zstd") else "gzip"
+
+def compress(raw: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        return pa.compress(raw, codec="zstd", asbytes=True)
+    elif compression == "gzip":
+        return gzip.compress(raw, compresslevel=6)
+    return raw
+
+def decompress(payload: bytes, codec: int, size: int) -> bytes:
+    if codec == CODECS["zstd"]:
+        if pa is None:
+            raise ValueError("zstd snapshots need pyarrow installed")
+        return pa.decompress(payload, decompressed_size=size, codec="zstd", asbytes=True)
+    elif codec == CODECS["gzip"]:
+        return gzip.decompress(payload)
+    return payload
+
+def encode_column(values: list) -> list | dict:
+    # Repeated strings are stored once, loading then shares one object per distinct address, title or name
+    if all(value is None or isinstance(value, str) for value in values):
+        strings = {}
+        codes = [strings.setdefault(value, len(strings)) for value in values]
+        if len(strings) <= len(values) // 2:
+            return {"strings" : list(strings), "codes" : codes}
+    return values
+
+def decode_column(column: list | dict) -> list:
+    if isinstance(column, dict):
+        strings = column["strings"]
+        return [strings[code] for code in column["codes"]]
+    return column
+
+def encode_sales(sales: list) -> dict:
+    keys = list(dict.fromkeys(key for sale in sales for key in sale))
+    columns = [encode_column([sale.get(key) for sale in sales]) for key in keys]
+    # Sales written before a field existed don't get it made up on load
+    missing = {key : rows for key in keys if (rows := [row for row, sale in enumerate(sales) if key not in sale])}
+    return {"keys" : keys, "columns" : columns, "missing" : missing}
+
+def decode_sales(encoded: dict) -> list:
+    columns = [decode_column(column) for column in encoded["columns"]]
+    sales = list(map(dict, map(zip, repeat(encoded["keys"]), zip(*columns))))
+
+    for key, rows in encoded["missing"].items():
+        for row in rows:
+            del sales[row][key]
+    return sales
+
+def write_snapshot(path: str, d: dict, compression: str | None = None) -> None:
+    compression = compression or get_default_compression()
+
+    payload = {"info" : d["info"], "sales" : encode_sales(d["sales"])}
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    header = HEADER.pack(MAGIC, CODECS[compression], len(raw), hashlib.sha256(raw).digest())
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(compress(raw, compression))
+    os.replace(tmp_path, path)
+
+def read_snapshot(path: str) -> dict:
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, codec, size, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a sales snapshot")
+
+    raw = decompress(data[HEADER.size:], codec, size)
+    if len(raw) != size or hashlib.sha256(raw).digest() != checksum:
+        raise ValueError(f"{path} is corrupted, checksum mismatch")
+
+    payload = json.loads(raw)
+    return {"info" : payload["info"], "sales" : decode_sales(payload["sales"])}
+
+def write_json(path: str, d: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(d, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def get_month_path(db_dir: str, month: str) -> str:
+    path = f"{db_dir}/{month}.snapshot"
+    # Months written before snapshots existed stay readable until they are saved again
+    if not os.path.exists(path) and os.path.exists(f"{db_dir}/{month}.json"):
+        return f"{db_dir}/{month}.json"
+    return path
+
+def load_month(db_dir: str, month: str) -> dict:
+    path = get_month_path(db_dir, month)
+
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    return read_snapshot(path)
+
+def save_month(db_dir: str, month: str, d: dict, compression: str | None = None) -> None:
+    write_snapshot(f"{db_dir}/{month}.snapshot", d, compression)
+
+def export_months(db_dir: str = "sales_db", months: list | None = None, export_dir: str | None = None) -> list:
+    # Readable copies are only written on request, they are never read back
+    export_dir = export_dir or f"{db_dir}/export"
+    os.makedirs(export_dir, exist_ok=True)
+
+    paths = []
+    for month in months or list_months(db_dir):
+        path = f"{export_dir}/{month}.json"
+        write_json(path, load_month(db_dir, month))
+        paths.append(path)
+    return paths
+
+def list_months(db_dir: str = "sales_db") -> list[str]:
+    months = set()
+    for path in glob(f"{db_dir}/*.json") + glob(f"{db_dir}/*.snapshot"):
+        month = os.path.splitext(os.path.basename(path))[0]
+        try:
+            datetime.strptime(month, "%B_%y")
+        except ValueError:
+            continue
+        months.add(month)
+
+    return sorted(months, key=lambda month: datetime.strptime(month, "%B_%y"))
+
+def convert(db_dir: str = "sales_db", compression: str | None = None) -> None:
+    for month in list_months(db_dir):
+        json_path = f"{db_dir}/{month}.json"
+        with month_lock(db_dir, month):
+            # Only months still kept as JSON are converted, the file is left where it was
+            if not get_month_path(db_dir, month).endswith(".json"):
+                continue
+
+            start = time.perf_counter()
+            d = load_month(db_dir, month)
+            json_time = time.perf_counter() - start
+
+            save_month(db_dir, month, d, compression)
+
+        snapshot_path = get_month_path(db_dir, month)
+        start = time.perf_counter()
+        read_snapshot(snapshot_path)
+        snapshot_time = time.perf_counter() - start
+
+        print(f"{month}: {os.path.getsize(json_path) / 1024:.0f} KiB -> {os.path.getsize(snapshot_path) / 1024:.0f} KiB, load {json_time * 1000:.1f} ms -> {snapshot_time * 1000:.1f} ms")
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="store months kept as JSON as snapshots")
+    convert_parser.add_argument("db_dir", nargs="?", default="sales_db")
+    convert_parser.add_argument("--compression", choices=list(CODECS))
+
+    export_parser = subparsers.add_parser("export", help="write readable JSON copies of stored months")
+    export_parser.add_argument("db_dir", nargs="?", default="sales_db")
+    export_parser.add_argument("--months", nargs="*", help="september_24 ..., every month by default")
+    export_parser.add_argument("--to", help="directory for the copies, <db_dir>/export by default")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert(args.db_dir, args.compression)
+    else:
+        for path in export_months(args.db_dir, args.months, args.to):
+            print(f"Exported {path}")
+
+if __name__ == "__main__":
+    main()
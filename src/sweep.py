@@ -0,0 +1,89 @@
+import os
+import json
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import requests
+
+from src.order_index import open_index, get_locations
+from src.sales import get_updated_cancellations
+from src.totals import apply_totals_delta
+from src.store import load_month, save_month, get_lock_timeout
+from src.utils import file_lock, to_meli_date_format
+
+BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
+
+def load_sweep_state(db_dir: str = "sales_db") -> dict:
+    try:
+        with open(f"{db_dir}/sweep.json", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+
+    if "last_swept" not in state:
+        # The first sweep goes back to the previous month, older months were synced with their cancellations
+        now = datetime.now(tz=BS_AS_TZ)
+        state["last_swept"] = to_meli_date_format((now.replace(day=1) - timedelta(days=1)).replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+    state.setdefault("stale_months", [])
+
+    return state
+
+def update_sweep_state(db_dir: str, update) -> None:
+    with file_lock(f"{db_dir}/sweep.json.lock", get_lock_timeout()):
+        state = load_sweep_state(db_dir)
+        update(state)
+
+        tmp_path = f"{db_dir}/sweep.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, f"{db_dir}/sweep.json")
+
+def save_last_swept(db_dir: str, swept_at: datetime) -> None:
+    update_sweep_state(db_dir, lambda state: state.update({"last_swept" : to_meli_date_format(swept_at)}))
+
+def add_stale_month(db_dir: str, month: str) -> None:
+    update_sweep_state(db_dir, lambda state: state["stale_months"].append(month) if month not in state["stale_months"] else None)
+
+def remove_stale_month(db_dir: str, month: str) -> None:
+    update_sweep_state(db_dir, lambda state: state.update({"stale_months" : [stale for stale in state["stale_months"] if stale != month]}))
+
+def collect_cancellations(s: requests.Session, user_id: int, db_dir: str, updated_from: str | datetime) -> dict:
+    cancelled_sales = get_updated_cancellations(s, user_id, updated_from)
+
+    index = open_index(db_dir)
+    locations = get_locations(index, {sale["id"] for sale in cancelled_sales})
+    index.close()
+
+    # Orders that were never synced belong to months this seller doesn't keep
+    months = {}
+    for sale in cancelled_sales:
+        if sale["id"] in locations:
+            month, row = locations[sale["id"]]
+            months.setdefault(month, {})[row] = sale
+
+    return months
+
+def mark_cancelled(db_dir: str, month: str, cancelled_sales: dict) -> list:
+    d = load_month(db_dir, month)
+    sales = d["sales"]
+
+    newly_cancelled = []
+    for row, sale in cancelled_sales.items():
+        # A stale index row falls back to looking the order up
+        if row >= len(sales) or sales[row]["id"] != sale["id"]:
+            row = next((idx for idx, stored_sale in enumerate(sales) if stored_sale["id"] == sale["id"]), None)
+            if row is None:
+                continue
+
+        if not sales[row]["cancelled"]:
+            sales[row]["cancelled"] = True
+            sales[row]["cancellation_date"] = sale["cancel_detail"]["date"]
+            newly_cancelled.append(sales[row])
+
+    # Recorded before the store changes, so a crash anywhere after this still gets the totals and tab redone
+    if newly_cancelled:
+        apply_totals_delta(d, cancelled=newly_cancelled)
+        add_stale_month(db_dir, month)
+        save_month(db_dir, month, d)
+
+    return newly_cancelled
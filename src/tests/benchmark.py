@@ -0,0 +1,162 @@
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import tempfile
+from glob import glob
+from unittest.mock import patch
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from src.sales import create_sales_dataframe
+from src.sheets import modify_sales_dataframe, create_cancellations_dataframe, create_sales_matrix
+from src.store import write_snapshot, read_snapshot
+from src.utils import format_numbers, get_invoice_num_formula
+
+BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
+
+# Timings only compare on the machine that made them, so the baseline is git-ignored and saved locally
+BASELINE_PATH = "src/tests/benchmark_baseline.json"
+
+class OfflineSheetsService:
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, **kwargs):
+        return self
+
+    def clear(self, **kwargs):
+        return self
+
+    def batchUpdate(self, **kwargs):
+        return self
+
+    def execute(self):
+        return {}
+
+def create_synthetic_record(size: int) -> list:
+    sales = []
+    for path in sorted(glob("src/tests/test_sales/*.json")):
+        with open(path, encoding="utf-8") as f:
+            sales.extend(json.load(f)["sales"])
+
+    record = []
+    for idx in range(size):
+        sale = dict(sales[idx % len(sales)])
+        sale["id"] = idx
+        sale.setdefault("cancellation_date", sale["sale_date"] if sale["cancelled"] else None)
+        record.append(sale)
+
+    return record
+
+def measure(func, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds" : min(times), "peak_bytes" : peak}
+
+def run_benchmarks(size: int, repeat: int) -> dict:
+    record = create_synthetic_record(size)
+    sales_df = create_sales_dataframe(record)
+    done_invoices = [idx % 3 == 0 for idx in range(size)]
+    modified_df, cancellations_info_df = modify_sales_dataframe(sales_df.copy(), list(done_invoices))
+
+    db_dir = tempfile.TemporaryDirectory()
+    start = datetime(2024, 9, 1, tzinfo=BS_AS_TZ)
+    json_path = f"{db_dir.name}/sales.json"
+    snapshot_path = f"{db_dir.name}/sales.snapshot"
+    
+    d = {"info" : {"date_last_updated" : "", "pending_cancellations" : [], "cancelled_indices" : []}, "sales" : record}
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(d, f, indent=2)
+    write_snapshot(snapshot_path, d)
+
+    def cancellations():
+        create_cancellations_dataframe(cancellations_info_df, OfflineSheetsService(), "", "", 0, start, db_dir.name)
+
+    def load_json():
+        with open(json_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    benchmarks = {
+        "create_sales_dataframe" : lambda: create_sales_dataframe(record),
+        "modify_sales_dataframe" : lambda: modify_sales_dataframe(sales_df.copy(), list(done_invoices)),
+        "create_cancellations_dataframe" : cancellations,
+        "format_numbers" : lambda: format_numbers(sales_df["unit_price"]),
+        "get_invoice_num_formula" : lambda: [get_invoice_num_formula(row=row+3, hyperlink=False) for row in range(size)],
+        "sales_matrix" : lambda: create_sales_matrix(modified_df, "septiembre"),
+        "load_month_json" : load_json,
+        "load_month_snapshot" : lambda: read_snapshot(snapshot_path)
+    }
+
+    # The month store is stubbed out, so create_cancellations_dataframe only times the transform
+    with patch("src.sheets.load_month", lambda db_dir, month: {"info" : {"pending_cancellations" : [], "cancelled_indices" : []}, "sales" : []}), \
+         patch("src.sheets.save_month", lambda db_dir, month, d: None):
+        results = {name : measure(func, repeat) for name, func in benchmarks.items()}
+
+    db_dir.cleanup()
+
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            try:
+                base = baseline[size][name]
+            except KeyError:
+                continue
+
+            for metric in ["seconds", "peak_bytes"]:
+                if result[metric] > base[metric] * (1 + tolerance):
+                    regressions.append(f"{name} ({size} rows): {metric} {result[metric]:.4g} > baseline {base[metric]:.4g}")
+
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true")
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes.split(","):
+        results[size] = run_benchmarks(int(size), args.repeat)
+        for name, result in results[size].items():
+            print(f"{size:>7} {name:<32} {result["seconds"] * 1000:10.2f} ms {result["peak_bytes"] / 2**20:10.2f} MiB")
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        return
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline for this machine at {args.baseline}, run with --save on a clean checkout to create it")
+        sys.exit(1)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
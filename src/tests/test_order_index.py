@@ -0,0 +1,35 @@
+from src.order_index import open_index, index_month, filter_new_sales, find_by_identification, get_locations
+
+def create_sale(id: int, identification: str = "DNI 30111222", sale_date: str = "2024-09-20T10:00:00.000-03:00") -> dict:
+    return {"id" : id, "identification" : identification, "sale_date" : sale_date}
+
+def test_filter_new_sales_drops_duplicates_and_other_months(tmp_path):
+    index = open_index(str(tmp_path))
+    index_month(index, "august_24", [create_sale(1)])
+    index_month(index, "september_24", [create_sale(2)])
+
+    sales = [create_sale(1), create_sale(2), create_sale(3), create_sale(3)]
+    new_sales = filter_new_sales(index, "september_24", sales)
+    index.close()
+
+    # Orders already in this month are kept, the caller decides what to do with them
+    assert [sale["id"] for sale in new_sales] == [2, 3]
+
+def test_index_month_reindexes_changed_months(tmp_path):
+    index = open_index(str(tmp_path))
+    index_month(index, "september_24", [create_sale(1), create_sale(2)])
+    index_month(index, "september_24", [create_sale(2), create_sale(1), create_sale(3)])
+
+    locations = get_locations(index, [1, 2, 3])
+    index.close()
+
+    assert locations == {2 : ("september_24", 0), 1 : ("september_24", 1), 3 : ("september_24", 2)}
+
+def test_find_by_identification_matches_wildcards_literally(tmp_path):
+    index = open_index(str(tmp_path))
+    index_month(index, "september_24", [create_sale(1, "CUIT 20_1"), create_sale(2, "CUIT 2091")])
+
+    assert find_by_identification(index, "20_1") == [("september_24", 0)]
+    assert find_by_identification(index, "CUIT 2091") == [("september_24", 1)]
+    assert find_by_identification(index, "%") == []
+    index.close()
@@ -0,0 +1,80 @@
+import csv
+import json
+from pathlib import Path
+from datetime import datetime
+
+from openpyxl import load_workbook
+
+from src.render import render, get_tab_mirror
+from src.sellers import Seller
+from src.sheets import save_mirror
+from src.store import save_month
+
+SALES_PATH = Path(__file__).parent / "test_sales" / "test_september_1.json"
+
+def load_record() -> list:
+    with open(SALES_PATH, encoding="utf-8") as f:
+        return json.load(f)["sales"]
+
+def create_seller(db_dir: str) -> Seller:
+    return Seller(name="Test", app_id="", secret_key="", user_id="", spreadsheet_id="SID",
+                  a_invoices_folder_id="", b_invoices_folder_id="", tab_prefix="Test", dotenv_path="", db_dir=db_dir)
+
+def test_render_csv(tmp_path):
+    record = load_record()
+    done_invoices = [True] + [False] * (len(record) - 1)
+    path = tmp_path / "september.csv"
+
+    render(record, 9, str(path), done_invoices)
+
+    with open(path, encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0][0] == "SEPTIEMBRE"
+    assert len(rows) == len(record) + 2
+    assert [row[1] for row in rows[2:4]] == ["True", "False"]
+
+def test_render_xlsx(tmp_path):
+    record = load_record()
+    path = tmp_path / "september.xlsx"
+
+    render(record, 9, str(path))
+
+    ws = load_workbook(path).active
+    assert ws.title == "SEPTIEMBRE"
+    assert ws.max_row == len(record) + 2
+
+def test_render_empty_month(tmp_path):
+    path = tmp_path / "september.xlsx"
+
+    render([], 9, str(path))
+
+    ws = load_workbook(path).active
+    assert ws.title == "SEPTIEMBRE"
+    assert ws.max_row == 2
+
+def test_render_uses_mirrored_invoice_links(tmp_path):
+    record = load_record()
+    invoice_links = ['=HYPERLINK("https://drive.google.com/file/d/1"; "00001-00000001A")']
+    path = tmp_path / "september.csv"
+
+    render(record, 9, str(path), [True], invoice_links)
+
+    with open(path, encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[2][9] == invoice_links[0]
+
+def test_tab_state_comes_from_the_mirror(tmp_path):
+    record = load_record()
+    seller = create_seller(str(tmp_path))
+    date = datetime(2024, 9, 1)
+    save_month(seller.db_dir, "september_24", {"info" : {"pending_cancellations" : [], "cancelled_indices" : []}, "sales" : record})
+
+    assert get_tab_mirror(seller, date) is None
+
+    done_invoices = [idx % 2 == 0 for idx in range(len(record))]
+    invoice_links = [f"link {idx}" for idx in range(len(record))]
+    save_mirror(seller.db_dir, "SID", "Test - SEP", "", record, done_invoices, invoice_links)
+
+    mirror = get_tab_mirror(seller, date)
+    assert mirror["done_invoices"] == done_invoices
+    assert mirror["invoice_links"] == invoice_links
@@ -0,0 +1,129 @@
+import json
+from pathlib import Path
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from src.order_index import open_index, index_month
+from src.sales import apply_changes
+
+BS_AS_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
+
+SALES_PATH = Path(__file__).parent / "test_sales" / "test_september_1.json"
+
+START = datetime(2024, 9, 1, tzinfo=BS_AS_TZ)
+END = datetime(2024, 10, 1, tzinfo=BS_AS_TZ)
+
+BUYER = {
+    "name" : "Ana",
+    "last_name" : "Gómez",
+    "identification" : {"type" : "DNI", "number" : "30111222"},
+    "taxes" : {"taxpayer_type" : {"description" : "Consumidor Final"}},
+    "address" : {"street_name" : "Mitre", "street_number" : "100", "city_name" : "Rosario", "zip_code" : "2000", "state" : {"name" : "Santa Fe"}}
+}
+
+class FakeResponse:
+    def __init__(self, body: dict) -> None:
+        self.body = body
+        self.content = json.dumps(body).encode("utf-8")
+
+    def json(self) -> dict:
+        return self.body
+
+class FakeSession:
+    def __init__(self, orders: list) -> None:
+        self.orders = orders
+        self.params = []
+
+    def get(self, url, params=None, **kwargs):
+        if url.endswith("/billing_info"):
+            return FakeResponse({"buyer" : {"billing_info" : BUYER}})
+
+        self.params.append(params)
+        return FakeResponse({"results" : self.orders if params["offset"] == 0 else []})
+
+    def get_max_age(self, end: datetime) -> int:
+        return 0
+
+    def record_projection(self, received: int, kept: int) -> None:
+        self.trimmed = received - kept
+
+def load_record() -> list:
+    with open(SALES_PATH, encoding="utf-8") as f:
+        record = json.load(f)["sales"]
+    for sale in record:
+        sale.setdefault("cancellation_date", None)
+    return record
+
+def create_order(id: int, status: str = "paid", date_closed: str = "2024-09-20T10:00:00.000-03:00") -> dict:
+    return {
+        "id" : id,
+        "status" : status,
+        "date_closed" : date_closed,
+        "cancel_detail" : {"date" : "2024-09-25T10:00:00.000-03:00"} if status == "cancelled" else None,
+        "order_items" : [{"item" : {"title" : "Marco"}, "quantity" : 2, "unit_price" : 1000}],
+        "paid_amount" : 2500,
+        "total_amount" : 2000,
+        "payments" : [{"shipping_cost" : 500}],
+        "buyer" : {"nickname" : "dropped by the projection"}
+    }
+
+def test_asks_for_orders_updated_since_the_last_run():
+    s = FakeSession([])
+
+    apply_changes(s, 1, load_record(), START, END, "2024-09-15T00:00:00.000-03:00")
+
+    assert s.params[0]["order.date_last_updated.from"] == "2024-09-15T00:00:00.000-03:00"
+
+def test_cancels_a_stored_sale():
+    record = load_record()
+    stored = record[0]
+    assert not stored["cancelled"]
+
+    sales = apply_changes(FakeSession([create_order(stored["id"], "cancelled")]), 1, record, START, END, "")
+
+    assert len(sales) == len(load_record())
+    assert sales[0]["cancelled"]
+    assert sales[0]["cancellation_date"] == "2024-09-25T10:00:00.000-03:00"
+
+def test_restores_a_sale_that_is_no_longer_cancelled():
+    record = load_record()
+    record[0]["cancelled"] = True
+    record[0]["cancellation_date"] = "2024-09-25T10:00:00.000-03:00"
+
+    sales = apply_changes(FakeSession([create_order(record[0]["id"])]), 1, record, START, END, "")
+
+    assert not sales[0]["cancelled"]
+    assert sales[0]["cancellation_date"] is None
+
+def test_unused_order_fields_are_trimmed_and_counted():
+    s = FakeSession([create_order(1)])
+
+    apply_changes(s, 1, load_record(), START, END, "")
+
+    assert s.trimmed > len('"buyer": {"nickname": "dropped by the projection"}')
+
+def test_unchanged_status_is_left_alone():
+    record = load_record()
+
+    sales = apply_changes(FakeSession([create_order(record[0]["id"])]), 1, record, START, END, "")
+
+    assert sales == load_record()
+
+def test_new_sales_are_appended_in_date_order():
+    orders = [create_order(2, date_closed="2024-09-21T10:00:00.000-03:00"), create_order(1, date_closed="2024-09-20T10:00:00.000-03:00")]
+
+    sales = apply_changes(FakeSession(orders), 1, load_record(), START, END, "")
+
+    assert [sale["id"] for sale in sales[-2:]] == [1, 2]
+    assert sales[-1]["name"] == "Ana Gómez"
+    assert sales[-1]["identification"] == "DNI 30111222"
+    assert sales[-1]["total"] == 2500
+
+def test_sales_stored_in_another_month_are_skipped(tmp_path):
+    index = open_index(str(tmp_path))
+    index_month(index, "august_24", [{"id" : 1, "identification" : "DNI 1", "sale_date" : "2024-08-31T23:00:00.000-03:00"}])
+
+    sales = apply_changes(FakeSession([create_order(1), create_order(2)]), 1, load_record(), START, END, "", index, "september_24")
+    index.close()
+
+    assert [sale["id"] for sale in sales[len(load_record()):]] == [2]
@@ -0,0 +1,31 @@
+from src.sheets import get_runs, get_live_formatting_rules, get_record_digest
+
+def test_get_runs_groups_consecutive_rows():
+    assert get_runs([True, True, False, True, False, False, True], 2) == [[2, 4], [5, 6], [8, 9]]
+
+def test_get_runs_without_flags():
+    assert get_runs([False, False], 2) == []
+    assert get_runs([], 2) == []
+
+def test_live_rules_skip_cancelled_rows():
+    rules = get_live_formatting_rules(7, [False, False, True, False])
+
+    assert len(rules) == 1
+    assert [(r["sheetId"], r["startRowIndex"], r["endRowIndex"]) for r in rules[0]["ranges"]] == [(7, 2, 4), (7, 5, 6)]
+
+def test_live_rule_formula_starts_at_the_first_range():
+    rules = get_live_formatting_rules(0, [True, True, False])
+
+    assert rules[0]["ranges"][0]["startRowIndex"] == 4
+    assert rules[0]["booleanRule"]["condition"]["values"][0]["userEnteredValue"] == "=$B5=TRUE"
+
+def test_live_rules_when_every_row_is_cancelled():
+    assert get_live_formatting_rules(0, [True, True]) == []
+
+def test_record_digest_follows_status_changes():
+    record = [{"id" : 1, "cancelled" : False, "cancellation_date" : None, "name" : "A"}]
+    cancelled = [{**record[0], "cancelled" : True, "cancellation_date" : "2024-09-25"}]
+    renamed = [{**record[0], "name" : "B"}]
+
+    assert get_record_digest(record) != get_record_digest(cancelled)
+    assert get_record_digest(record) == get_record_digest(renamed)
@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src.store import HEADER, write_snapshot, read_snapshot, save_month, load_month, export_months
+
+SALES_PATH = Path(__file__).parent / "test_sales" / "test_september_1.json"
+
+def load_fixture() -> dict:
+    with open(SALES_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_snapshot_round_trip(tmp_path, compression):
+    d = load_fixture()
+    path = tmp_path / "september_24.snapshot"
+
+    write_snapshot(str(path), d, compression)
+
+    assert read_snapshot(str(path)) == d
+
+def test_snapshot_default_compression_round_trip(tmp_path):
+    d = load_fixture()
+    path = tmp_path / "september_24.snapshot"
+
+    write_snapshot(str(path), d)
+
+    assert read_snapshot(str(path)) == d
+
+def test_snapshot_checksum_catches_corruption(tmp_path):
+    path = tmp_path / "september_24.snapshot"
+    write_snapshot(str(path), load_fixture(), "none")
+
+    data = bytearray(path.read_bytes())
+    data[-2] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="checksum"):
+        read_snapshot(str(path))
+
+def test_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "september_24.snapshot"
+    path.write_bytes(b"x" * HEADER.size)
+
+    with pytest.raises(ValueError, match="not a sales snapshot"):
+        read_snapshot(str(path))
+
+def test_snapshot_keeps_missing_fields_missing(tmp_path):
+    d = load_fixture()
+    for sale in d["sales"]:
+        sale.pop("cancellation_date", None)
+    d["sales"][0]["cancellation_date"] = None
+    path = tmp_path / "september_24.snapshot"
+
+    write_snapshot(str(path), d, "none")
+    sales = read_snapshot(str(path))["sales"]
+
+    assert sales[0]["cancellation_date"] is None
+    assert all("cancellation_date" not in sale for sale in sales[1:])
+
+def test_snapshot_shares_repeated_strings(tmp_path):
+    d = load_fixture()
+    d["sales"] = [dict(d["sales"][0], id=idx) for idx in range(4)]
+    path = tmp_path / "september_24.snapshot"
+
+    write_snapshot(str(path), d, "none")
+    sales = read_snapshot(str(path))["sales"]
+
+    assert sales[0]["address"] is sales[3]["address"]
+
+def test_empty_month_round_trip(tmp_path):
+    d = {"info" : {"cancelled_indices" : []}, "sales" : []}
+    path = tmp_path / "september_24.snapshot"
+
+    write_snapshot(str(path), d)
+
+    assert read_snapshot(str(path)) == d
+
+def test_readable_copies_are_only_exported_on_request(tmp_path):
+    d = load_fixture()
+
+    save_month(str(tmp_path), "september_24", d)
+
+    assert load_month(str(tmp_path), "september_24") == d
+    assert not (tmp_path / "september_24.json").exists()
+
+    paths = export_months(str(tmp_path))
+
+    assert paths == [f"{tmp_path}/export/september_24.json"]
+    with open(paths[0], encoding="utf-8") as f:
+        assert json.load(f) == d
@@ -0,0 +1,78 @@
+import json
+from pathlib import Path
+
+from src.totals import update_totals, load_totals, create_summary, count_totals, apply_totals_delta
+
+SALES_PATH = Path(__file__).parent / "test_sales" / "test_september_1.json"
+
+def load_record() -> list:
+    with open(SALES_PATH, encoding="utf-8") as f:
+        return json.load(f)["sales"]
+
+def create_month(sales: list) -> dict:
+    return {"info" : {}, "sales" : sales}
+
+def test_count_totals_skips_cancelled_sales():
+    record = load_record()
+    record[0]["cancelled"] = True
+
+    totals = count_totals(record)
+
+    counted = [sale for sale in record if not sale["cancelled"]]
+    assert totals["sales"] == len(counted)
+    assert sum(totals["invoice_type"].values()) == sum(sale["total"] for sale in counted)
+
+def test_month_without_totals_is_counted_once():
+    d = create_month(load_record())
+
+    assert apply_totals_delta(d, added=d["sales"][:1]) == count_totals(d["sales"])
+    assert d["info"]["totals"] == count_totals(d["sales"])
+
+def test_deltas_match_a_recount():
+    record = [sale for sale in load_record() if not sale["cancelled"]]
+    d = create_month(record[:2])
+    apply_totals_delta(d)
+
+    d["sales"] = record
+    apply_totals_delta(d, added=record[2:])
+    record[0]["cancelled"] = True
+    apply_totals_delta(d, cancelled=record[:1])
+
+    assert d["info"]["totals"] == count_totals(record)
+
+    record[0]["cancelled"] = False
+    apply_totals_delta(d, restored=record[:1])
+
+    assert d["info"]["totals"] == count_totals(record)
+
+def test_cancelling_the_last_sale_of_a_key_drops_it():
+    record = load_record()[:1]
+    d = create_month(record)
+    apply_totals_delta(d)
+
+    record[0]["cancelled"] = True
+    totals = apply_totals_delta(d, cancelled=record)
+
+    assert totals == count_totals([])
+
+def test_update_totals_replaces_only_its_month(tmp_path):
+    record = [sale for sale in load_record() if not sale["cancelled"]]
+    update_totals(str(tmp_path), "august_24", count_totals(record[:3]))
+    update_totals(str(tmp_path), "september_24", count_totals(record))
+
+    totals = update_totals(str(tmp_path), "september_24", count_totals(record[:1]))
+
+    assert totals["august_24"]["sales"] == 3
+    assert totals["september_24"]["sales"] == 1
+    assert load_totals(str(tmp_path)) == totals
+
+def test_summary_lists_months_in_order(tmp_path):
+    record = load_record()
+    update_totals(str(tmp_path), "september_24", count_totals(record))
+    update_totals(str(tmp_path), "august_24", count_totals(record))
+
+    summary = create_summary(load_totals(str(tmp_path)))
+
+    assert summary[0] == ["MES", "CATEGORÍA", "VALOR", "TOTAL"]
+    assert summary[1][0] == "AGOSTO 24"
+    assert summary[-1][0] == "SEPTIEMBRE 24"
@@ -0,0 +1,200 @@
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+import requests
+from dotenv import find_dotenv, dotenv_values, set_key
+
+from src.cache import ResponseCache, get_max_age
+from src.hedging import Hedger
+from src.utils import refresh_token, file_lock
+
+class TokenManager:
+    def __init__(self, app_id: int, secret_key: str, dotenv_path: str | None = None, margin: timedelta = timedelta(minutes=30)) -> None:
+        self.app_id = app_id
+        self.secret_key = secret_key
+        self.dotenv_path = dotenv_path or find_dotenv()
+        self.margin = margin
+
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._load()
+
+    @property
+    def access_token(self) -> str:
+        with self._lock:
+            if self._expiring():
+                self.refresh()
+            return self._access_token
+
+    def refresh(self, force: bool = False) -> None:
+        with self._lock, file_lock(f"{self.dotenv_path}.lock"):
+            stale_token = self._access_token
+
+            # Another process may have refreshed while we were waiting for the lock
+            self._load()
+            if not self._expiring() and (not force or self._access_token != stale_token):
+                return
+
+            r = refresh_token(self.app_id, self.secret_key, self._refresh_token)
+
+            self._access_token = r["access_token"]
+            self._refresh_token = r["refresh_token"]
+            self._expiration_date = datetime.now() + timedelta(seconds=r.get("expires_in", 6 * 60 * 60))
+
+            self._save()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _refresh_loop(self) -> None:
+        while True:
+            with self._lock:
+                wait = (self._expiration_date - self.margin - datetime.now()).total_seconds()
+
+            if self._stop.wait(max(wait, 0)):
+                return
+
+            try:
+                self.refresh()
+            except (requests.RequestException, KeyError) as e:
+                print(f"Could not refresh the MercadoLibre token: {e}")
+                if self._stop.wait(60):
+                    return
+
+    def _expiring(self) -> bool:
+        return datetime.now() >= self._expiration_date - self.margin
+
+    def _load(self) -> None:
+        values = dotenv_values(self.dotenv_path)
+
+        self._access_token = values["ACCESS_TOKEN"]
+        self._refresh_token = values["REFRESH_TOKEN"]
+        self._expiration_date = datetime.fromisoformat(values["EXPIRATION_DATE"])
+
+    def _save(self) -> None:
+        tmp_path = f"{self.dotenv_path}.tmp"
+        shutil.copyfile(self.dotenv_path, tmp_path)
+
+        set_key(tmp_path, "ACCESS_TOKEN", self._access_token, "never")
+        set_key(tmp_path, "REFRESH_TOKEN", self._refresh_token, "never")
+        set_key(tmp_path, "EXPIRATION_DATE", self._expiration_date.isoformat(timespec="milliseconds"), "never")
+
+        os.replace(tmp_path, self.dotenv_path)
+
+# (connect, read) seconds, so a request the hedger stopped waiting for can't hold its worker forever
+REQUEST_TIMEOUT = (10, 60)
+
+class MeliSession(requests.Session):
+    def __init__(self, tokens: TokenManager, cache: ResponseCache | None = None, hedger: Hedger | None = None, timeout: tuple | float = REQUEST_TIMEOUT) -> None:
+        super().__init__()
+        self.tokens = tokens
+        self.cache = cache
+        self.hedger = hedger
+        self.timeout = timeout
+
+        # What orders/search sent, what gzip sent over the wire for it and what is left after trimming the orders
+        self.wire_bytes = 0
+        self.content_bytes = 0
+        self.received_order_bytes = 0
+        self.kept_order_bytes = 0
+        self._stats_lock = threading.Lock()
+
+        self._worker_sessions = threading.local()
+        self._opened_sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def get_max_age(self, end: datetime) -> int:
+        return self.cache.get_max_age(end) if self.cache is not None else get_max_age(end)
+
+    def request(self, method, url, headers=None, max_age: int | None = None, hedge: bool = False, **kwargs) -> requests.Response:
+        headers = dict(headers or {})
+        kwargs.setdefault("timeout", self.timeout)
+
+        if self.cache is None or method.upper() != "GET" or max_age is None:
+            return self.hedged_request(method, url, headers, hedge, **kwargs)
+
+        key = self.cache.get_key(url, kwargs.get("params"), headers)
+        entry = self.cache.load(key)
+
+        if entry is not None and self.cache.is_fresh(entry, max_age):
+            self.cache.hits += 1
+            return self.cache.to_response(entry)
+
+        if entry is not None:
+            headers.update(self.cache.get_conditional_headers(entry))
+
+        r = self.hedged_request(method, url, headers, hedge, **kwargs)
+
+        return self.cache.store(key, r, entry)
+
+    def hedged_request(self, method, url, headers: dict, hedge: bool = False, **kwargs) -> requests.Response:
+        if hedge and self.hedger is not None:
+            # The original and its duplicate run at once, each on its worker's own session
+            return self.hedger.call(lambda: self.authorized_request(method, url, headers, self.get_worker_session(), **kwargs))
+        return self.authorized_request(method, url, headers, **kwargs)
+
+    def authorized_request(self, method, url, headers: dict, session: requests.Session | None = None, **kwargs) -> requests.Response:
+        send = session.request if session is not None else super().request
+
+        r = send(method, url, headers={**headers, "Authorization" : f"Bearer {self.tokens.access_token}"}, **kwargs)
+
+        if r.status_code == 401:
+            self.tokens.refresh(force=True)
+            r = send(method, url, headers={**headers, "Authorization" : f"Bearer {self.tokens.access_token}"}, **kwargs)
+
+        self.record_transfer(r)
+
+        return r
+
+    def record_transfer(self, r: requests.Response) -> None:
+        # tell() counts the bytes read off the socket, before urllib3 decodes the gzip
+        with self._stats_lock:
+            self.wire_bytes += r.raw.tell() if r.raw is not None else len(r.content)
+            self.content_bytes += len(r.content)
+
+    def record_projection(self, received: int, kept: int) -> None:
+        with self._stats_lock:
+            self.received_order_bytes += received
+            self.kept_order_bytes += kept
+
+    def get_worker_session(self) -> requests.Session:
+        session = getattr(self._worker_sessions, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            # Adapters keep thread-safe connection pools, so mounted ones are shared
+            for prefix, adapter in self.adapters.items():
+                session.mount(prefix, adapter)
+
+            self._worker_sessions.session = session
+            with self._sessions_lock:
+                self._opened_sessions.append(session)
+        return session
+
+    def close(self, keep_adapters: bool = False) -> None:
+        with self._sessions_lock:
+            for session in self._opened_sessions:
+                # Adapters mounted from this session are only borrowed, they are closed below with it
+                for prefix in self.adapters:
+                    session.adapters.pop(prefix, None)
+                session.close()
+            self._opened_sessions.clear()
+
+        # An adapter handed in by run_all is shared by every seller and closed there
+        if not keep_adapters:
+            super().close()
@@ -0,0 +1,117 @@
+import os
+import json
+from datetime import datetime
+
+from googleapiclient.errors import HttpError
+
+from src.sheets import add_sheet
+from src.store import get_lock_timeout
+from src.utils import A_INVOICE_TAX_STATUSES, month_to_spanish, file_lock
+
+CATEGORIES = {
+    "invoice_type" : "TIPO FACTURA",
+    "jurisdiction" : "JURISDICCION",
+    "tax_status" : "CONDICION IVA"
+}
+
+def create_month_totals() -> dict:
+    totals = {category : {} for category in CATEGORIES}
+    totals["sales"] = 0
+    return totals
+
+def add_to_totals(totals: dict, sale: dict, sign: int = 1) -> None:
+    keys = {
+        "invoice_type" : "A" if sale["tax_status"] in A_INVOICE_TAX_STATUSES else "B",
+        "jurisdiction" : sale["jurisdiction"],
+        "tax_status" : sale["tax_status"]
+    }
+
+    for category, key in keys.items():
+        total = round(totals[category].get(key, 0) + sign * sale["total"], 2)
+        # A key whose last sale was cancelled is dropped, like a month counted from scratch would have it
+        if total or sign > 0:
+            totals[category][key] = total
+        else:
+            totals[category].pop(key, None)
+    totals["sales"] += sign
+
+def count_totals(sales: list) -> dict:
+    totals = create_month_totals()
+    for sale in sales:
+        if not sale["cancelled"]:
+            add_to_totals(totals, sale)
+    return totals
+
+def apply_totals_delta(d: dict, added: list = (), cancelled: list = (), restored: list = ()) -> dict:
+    # Kept in the month snapshot, so save_month writes the totals and the sales they count together
+    if "totals" not in d["info"]:
+        # Months stored before their totals were kept are counted once, with the changes already applied
+        d["info"]["totals"] = count_totals(d["sales"])
+        return d["info"]["totals"]
+
+    totals = d["info"]["totals"]
+    for sale in added:
+        if not sale["cancelled"]:
+            add_to_totals(totals, sale)
+    for sale in restored:
+        add_to_totals(totals, sale)
+    for sale in cancelled:
+        add_to_totals(totals, sale, -1)
+    return totals
+
+def load_totals(db_dir: str = "sales_db") -> dict:
+    try:
+        with open(f"{db_dir}/totals.json", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def update_totals(db_dir: str, month: str, month_totals: dict) -> dict:
+    # totals.json only copies the saved month's totals, so publishing again after a crash changes nothing
+    # Runs for different months of the same seller share totals.json
+    with file_lock(f"{db_dir}/totals.json.lock", get_lock_timeout()):
+        totals = load_totals(db_dir)
+        totals[month] = month_totals
+
+        tmp_path = f"{db_dir}/totals.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(totals, f, indent=2)
+        os.replace(tmp_path, f"{db_dir}/totals.json")
+
+    return totals
+
+def create_summary(totals: dict) -> list:
+    summary = [["MES", "CATEGORÍA", "VALOR", "TOTAL"]]
+
+    for month in sorted(totals, key=lambda month: datetime.strptime(month, "%B_%y")):
+        date = datetime.strptime(month, "%B_%y")
+        month_label = f"{month_to_spanish(date.month).upper()} {date:%y}"
+
+        for category, label in CATEGORIES.items():
+            for key, total in sorted(totals[month][category].items()):
+                summary.append([month_label, label, key, total])
+
+    return summary
+
+def write_summary(service, spreadsheet_id: str, totals: dict, sheet_name: str, sheet_id: int) -> None:
+    # Months and categories can disappear, so rows left over from a longer summary are cleared first
+    try:
+        service.spreadsheets().values().clear(spreadsheetId=spreadsheet_id,
+                                              range=f"'{sheet_name}'!A:D",
+                                              fields="spreadsheetId").execute()
+    except HttpError:
+        add_sheet(service, spreadsheet_id, sheet_id, sheet_name)
+    
+    body = {
+        "valueInputOption" : "USER_ENTERED",
+        "data" : [
+            {
+                "range" : f"'{sheet_name}'!A1:D",
+                "values" : create_summary(totals)
+            }
+        ]
+    }
+
+    service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id,
+                                                body=body,
+                                                fields="spreadsheetId").execute()
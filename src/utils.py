@@ -1,10 +1,19 @@
-from datetime import datetime, timedelta
+import os
+import time
+from datetime import datetime
+from contextlib import contextmanager
 
 import requests
 import pandas as pd
-from dotenv import find_dotenv, set_key
 
-def refresh_token(app_id: int, secret_key: str, refresh_token: str) -> str:
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+A_INVOICE_TAX_STATUSES = ["Monotributo", "IVA Responsable Inscripto"]
+
+def refresh_token(app_id: int, secret_key: str, refresh_token: str) -> dict:
     r = requests.post("https://api.mercadolibre.com/oauth/token",
            headers={"accept" : "application/json",
                     "content-type" : "application/x-www-form-urlencoded"},  
@@ -12,14 +21,34 @@ def refresh_token(app_id: int, secret_key: str, refresh_token: str) -> str:
                  "client_id" : app_id,
                  "client_secret" : secret_key,
                  "refresh_token" : refresh_token})
-    r = r.json()
-    
-    dotenv_path = find_dotenv()
-    set_key(dotenv_path, "ACCESS_TOKEN", r["access_token"], "never")
-    set_key(dotenv_path, "REFRESH_TOKEN", r["refresh_token"], "never")
-    set_key(dotenv_path, "EXPIRATION_DATE", (datetime.now() + timedelta(hours=6)).isoformat(timespec="milliseconds"), "never")
+    r.raise_for_status()
     
-    return r["access_token"]
+    return r.json()
+
+@contextmanager
+def file_lock(path: str, timeout: float | None = None):
+    start = time.monotonic()
+    with open(path, "a+") as f:
+        while True:
+            try:
+                if os.name == "nt":
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if timeout is not None and time.monotonic() - start >= timeout:
+                    raise TimeoutError(f"Could not lock {path} after {timeout} seconds")
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
 def to_meli_date_format(date: str | datetime) -> str:
     if type(date) == str:
@@ -55,8 +84,17 @@ def format_numbers(s: pd.Series) -> pd.Series:
     s = s.str.replace(".0$", "", regex=True)
     return s
 
-def get_invoice_num_formula(*, url: str | None = None, num: str | None = None, row: int | None = None, hyperlink: bool = True) -> str:
+def get_invoice_num_formula(*, url: str | None = None, num: str | None = None, row: int | None = None, hyperlink: bool = True, tab_prefix: str = "Daniel", previous_tab: tuple[str, str] | None = None) -> str:
     if hyperlink:
         return f"=HYPERLINK(\"{url}\"; \"{num}\")"
+    
+    if previous_tab:
+        # The previous month lives in another spreadsheet, last year's or the archive
+        previous_spreadsheet_id, previous_sheet_name = previous_tab
+        previous_types = f"IMPORTRANGE(\"{previous_spreadsheet_id}\"; \"'{previous_sheet_name}'!D:D\")"
+        previous_numbers = f"IMPORTRANGE(\"{previous_spreadsheet_id}\"; \"'{previous_sheet_name}'!J:J\")"
     else:
-        return f"=LET(num; XLOOKUP(D{row}; D$2:D{row-1}; J$2:J{row-1}; XLOOKUP(D{row}; INDIRECT(\"Daniel - \"&LEFT(TEXT(DATE(; MONTH(A$1&1)-1; 1); \"mmmm\"); 3)&\"!D:D\"); INDIRECT(\"Daniel - \"&LEFT(TEXT(DATE(; MONTH(A$1&1)-1; 1); \"mmmm\"); 3)&\"!J:J\");;; -1);; -1); IF(C{row}=C{row-1}; J{row-1}; IF(NOT(REGEXMATCH(D{row}; \"\([AB]\)\")); LEFT(num; LEN(num)-1)+1&D{row}; \"\")))"
\ No newline at end of file
+        previous_types = f"INDIRECT(\"{tab_prefix} - \"&LEFT(TEXT(DATE(; MONTH(A$1&1)-1; 1); \"mmmm\"); 3)&\"!D:D\")"
+        previous_numbers = f"INDIRECT(\"{tab_prefix} - \"&LEFT(TEXT(DATE(; MONTH(A$1&1)-1; 1); \"mmmm\"); 3)&\"!J:J\")"
+    
+    return f"=LET(num; XLOOKUP(D{row}; D$2:D{row-1}; J$2:J{row-1}; XLOOKUP(D{row}; {previous_types}; {previous_numbers};;; -1);; -1); IF(C{row}=C{row-1}; J{row-1}; IF(NOT(REGEXMATCH(D{row}; \"\([AB]\)\")); LEFT(num; LEN(num)-1)+1&D{row}; \"\")))"
\ No newline at end of file